@@ -1,25 +1,81 @@
-from fastapi import FastAPI
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field, computed_field
-from typing import Literal, Annotated
-import pickle
+import time
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, Request, HTTPException, Header
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, computed_field, TypeAdapter, ValidationError
+from typing import Literal, Annotated, Optional
+from contextlib import asynccontextmanager
+import asyncio
+import io
+import os
+import secrets
 import pandas as pd
+from inference_pool import InferencePool, PoolSaturated
+from instrumentation import instrument, phase, TimedJSONResponse as JSONResponse
+import insurance_features
+from insurance_features import INPUT_COLUMNS, FEATURE_COLUMNS, engineer_features
+from micro_batcher import MicroBatcher
+from model_registry import ModelRegistry
+from prediction_cache import PredictionCache
+
+MODEL_PATH = os.environ.get('MODEL_PATH', 'exp_notebook/model.pkl')
+
+# the ml model is no longer unpickled at import time: the registry loads it in the lifespan below
+# (MODEL_BACKGROUND_LOAD=1 loads it in a thread and /ready says when it's there), converts it to a
+# memory-mapped joblib file, compiles it (PREDICT_COMPILED=0 to skip) and hot-swaps it when the file
+# changes (checked every MODEL_WATCH_INTERVAL seconds, 0 to disable) or on POST /admin/reload
+registry = ModelRegistry(MODEL_PATH, mmap=os.environ.get('MODEL_MMAP', '1') != '0',
+                         compile=os.environ.get('PREDICT_COMPILED', '1') != '0')
+MODEL_BACKGROUND_LOAD = os.environ.get('MODEL_BACKGROUND_LOAD', '0') == '1'
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', 2))
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')  # /admin/* answers 403 while it is unset
+
+# INFERENCE_BACKEND=process scores in a pool of INFERENCE_PROCESSES worker processes (default: one per
+# cpu) instead of in threads of this process, where the GIL lets only one batch run at a time. A request
+# that can't get one of the pool's shared-memory slots within INFERENCE_ACQUIRE_TIMEOUT seconds gets a 503.
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'thread')
+pool = InferencePool(
+    MODEL_PATH, processes=int(os.environ.get('INFERENCE_PROCESSES', 0)) or None,
+    acquire_timeout=float(os.environ.get('INFERENCE_ACQUIRE_TIMEOUT', 1)),
+    mmap=registry.mmap,
+) if INFERENCE_BACKEND == 'process' else None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if MODEL_BACKGROUND_LOAD:
+        registry.load_in_background()
+    else:
+        await run_in_threadpool(registry.load)
+    if pool is not None:
+        await run_in_threadpool(pool.start)
+    if MODEL_WATCH_INTERVAL > 0:
+        registry.watch(MODEL_WATCH_INTERVAL)
+    yield
+    registry.stop()
+    if pool is not None:
+        pool.close()
+
+app = FastAPI(lifespan=lifespan, default_response_class=JSONResponse)
+instrument(app)  # per-route latency and phase timings on /metrics, opt-in profiling (see instrumentation.py)
 
-# import the ml model
-with open('exp_notebook/model.pkl', 'rb') as f:
-    model = pickle.load(f)
+# rows scored per predict_proba call in /predict/batch
+BATCH_CHUNK = 4096
 
-app = FastAPI()
+# concurrent /predict requests are merged into one model call of up to PREDICT_MAX_BATCH rows,
+# waiting at most PREDICT_MAX_WAIT_MS for the batch to fill up. PREDICT_MAX_QUEUE caps how many requests
+# may wait for a batch (0 = no cap, beyond it they get a 503); batches run one at a time on the thread
+# backend and one per worker process on the process backend.
+PREDICT_MAX_BATCH = int(os.environ.get('PREDICT_MAX_BATCH', 64))
+PREDICT_MAX_WAIT_MS = float(os.environ.get('PREDICT_MAX_WAIT_MS', 5))
+PREDICT_MAX_QUEUE = int(os.environ.get('PREDICT_MAX_QUEUE', 0))
 
-tier_1_cities = ["Mumbai", "Delhi", "Bangalore", "Chennai", "Kolkata", "Hyderabad", "Pune"]
-tier_2_cities = [
-    "Jaipur", "Chandigarh", "Indore", "Lucknow", "Patna", "Ranchi", "Visakhapatnam", "Coimbatore",
-    "Bhopal", "Nagpur", "Vadodara", "Surat", "Rajkot", "Jodhpur", "Raipur", "Amritsar", "Varanasi",
-    "Agra", "Dehradun", "Mysore", "Jabalpur", "Guwahati", "Thiruvananthapuram", "Ludhiana", "Nashik",
-    "Allahabad", "Udaipur", "Aurangabad", "Hubli", "Belgaum", "Salem", "Vijayawada", "Tiruchirappalli",
-    "Bhavnagar", "Gwalior", "Dhanbad", "Bareilly", "Aligarh", "Gaya", "Kozhikode", "Warangal",
-    "Kolhapur", "Bilaspur", "Jalandhar", "Noida", "Guntur", "Asansol", "Siliguri"
-]
+# /predict results are cached per engineered feature row; PREDICT_CACHE_SIZE=0 turns the cache off.
+# The *_STEP settings round bmi / income_lpa in the cache key so nearby inputs share an entry.
+PREDICT_CACHE_SIZE = int(os.environ.get('PREDICT_CACHE_SIZE', 10000))
+PREDICT_CACHE_TTL = float(os.environ.get('PREDICT_CACHE_TTL', 3600))
+PREDICT_CACHE_BMI_STEP = float(os.environ.get('PREDICT_CACHE_BMI_STEP', 0))
+PREDICT_CACHE_INCOME_STEP = float(os.environ.get('PREDICT_CACHE_INCOME_STEP', 0))
 
 # pydantic model to validate incoming data
 class UserInput(BaseModel):
@@ -36,71 +92,190 @@ class UserInput(BaseModel):
     @computed_field
     @property
     def bmi(self) -> float:
-        return self.weight/(self.height**2)
+        return insurance_features.bmi(self.weight, self.height)
     
     @computed_field
     @property
     def lifestyle_risk(self) -> str:
-        if self.smoker and self.bmi > 30:
-            return "high"
-        elif self.smoker or self.bmi > 27:
-            return "medium"
-        else:
-            return "low"
+        return insurance_features.lifestyle_risk(self.smoker, self.bmi)
         
     @computed_field
     @property
     def age_group(self) -> str:
-        if self.age < 25:
-            return "young"
-        elif self.age < 45:
-            return "adult"
-        elif self.age < 60:
-            return "middle_aged"
-        return "senior"
+        return insurance_features.age_group(self.age)
     
     @computed_field
     @property
     def city_tier(self) -> int:
-        if self.city in tier_1_cities:
-            return 1
-        elif self.city in tier_2_cities:
-            return 2
-        else:
-            return 3
+        return insurance_features.city_tier(self.city)
+
+def current_model():
+    """The model version to use for this request; it stays the same even if a reload swaps in a new one."""
+    current = registry.current
+    if current is None:
+        raise HTTPException(status_code=503, detail="Model is not loaded yet")
+    return current
+
+def model_proba(mv, features=None, rows=None):
+    """Class probabilities for a feature frame, or for ``rows``, a list of feature dicts."""
+    if pool is not None:
+        if mv.compiled is None:
+            return pool.predict_proba(mv, features=pd.DataFrame(rows) if rows is not None else features)
+        X = mv.compiled.encode_rows(rows) if rows is not None else mv.compiled.encode_frame(features)
+        return pool.predict_proba(mv, X=X)
+    if mv.compiled is not None:
+        return mv.compiled.predict_proba_rows(rows) if rows is not None else mv.compiled.predict_proba_frame(features)
+    return mv.model.predict_proba(pd.DataFrame(rows) if rows is not None else features)
+
+def score(mv, features=None, rows=None):
+    """Class labels, confidences and probability matrix for a feature frame or list of feature dicts.
+
+    One predict_proba call gives both: the predicted class is the argmax of the
+    probabilities, so the forest doesn't have to run a second time for predict().
+    """
+    if not hasattr(mv.model, 'predict_proba'):
+        return mv.model.predict(pd.DataFrame(rows) if rows is not None else features), None, None
+    proba = model_proba(mv, features, rows)
+    return mv.model.classes_[proba.argmax(axis=1)], proba.max(axis=1), proba
+
+def prediction_responses(mv, labels, confidence, proba):
+    if proba is None:
+        return [{'predicted_category': label, 'confidence': None, 'class_probabilities': {}} for label in labels]
+    classes = [str(c) for c in mv.model.classes_]
+    return [{
+        'predicted_category': str(label),
+        'confidence': float(confidence[i]),
+        'class_probabilities': dict(zip(classes, proba[i].tolist()))
+    } for i, label in enumerate(labels)]
+
+def predict_rows(rows):
+    """Score a list of feature dicts with a single model call (runs in a worker thread).
+
+    Each response comes back with the version of the model that produced it.
+    """
+    mv = current_model()
+    return [(mv.version, response) for response in prediction_responses(mv, *score(mv, rows=rows))]
+
+batcher = MicroBatcher(predict_rows, max_batch_size=PREDICT_MAX_BATCH, max_wait=PREDICT_MAX_WAIT_MS / 1000,
+                       max_concurrent=pool.processes if pool is not None else 1, max_queue=PREDICT_MAX_QUEUE)
+
+cache = PredictionCache(
+    FEATURE_COLUMNS, maxsize=PREDICT_CACHE_SIZE, ttl=PREDICT_CACHE_TTL,
+    quantize={'bmi': PREDICT_CACHE_BMI_STEP, 'income_lpa': PREDICT_CACHE_INCOME_STEP},
+    model_stamp=lambda: registry.current and registry.current.version,  # a new model version empties the cache
+)
+
+@app.exception_handler(PoolSaturated)
+@app.exception_handler(asyncio.QueueFull)
+async def overloaded(request: Request, exc: Exception):
+    return JSONResponse(status_code=503, content={'detail': 'Prediction capacity exhausted, retry shortly'},
+                        headers={'Retry-After': '1'})
 
 @app.post('/predict')
-def predict_premium(data: UserInput):
+async def predict_premium(data: UserInput):
+    current_model()  # 503 until the model is loaded
 
-    input_df = pd.DataFrame([{
+    input_row = {
         'bmi': data.bmi,
         'age_group': data.age_group,
         'lifestyle_risk': data.lifestyle_risk,
         'city_tier': data.city_tier,
         'income_lpa': data.income_lpa,
         'occupation': data.occupation
-    }])
+    }
 
-    prediction = model.predict(input_df)[0]
+    key = cache.key(input_row)
+    response = cache.get(key)
+    if response is None:
+        with phase('inference'):  # includes the wait for the micro-batch to fill up
+            model_version, response = await batcher.submit(input_row)
+        cache.put(key, response, model_version)  # dropped if the model was swapped while this was scored
 
-    # Get class probabilities if available
-    if hasattr(model, 'predict_proba'):
-        proba = model.predict_proba(input_df)[0]
-        class_labels = model.classes_
-        class_probabilities = {str(label): float(prob) for label, prob in zip(class_labels, proba)}
-        confidence = float(max(proba))
-    else:
-        class_probabilities = {}
-        confidence = None
+    return JSONResponse(status_code=200, content={'response': response})
 
-    response = {
-        'predicted_category': prediction,
-        'confidence': confidence,
-        'class_probabilities': class_probabilities
-    }
+@app.get('/predict/stats')
+def predict_stats():
+    return {'batcher': batcher.stats(), 'cache': cache.stats(), 'pool': pool.stats() if pool is not None else None}
 
-    return JSONResponse(status_code=200, content={'response': response})
+user_batch = TypeAdapter(list[UserInput])
+
+def predict_frame(mv, raw):
+    """Score a frame of raw user columns in chunks of BATCH_CHUNK rows (one per worker process at a time)."""
+    with phase('features'):
+        features = engineer_features(raw)
+    chunk = BATCH_CHUNK * (pool.processes if pool is not None else 1)
+    results = []
+    for start in range(0, len(features), chunk):
+        with phase('inference'):
+            scored = score(mv, features.iloc[start:start + chunk])
+        results.extend(prediction_responses(mv, *scored))
+    return results
+
+@app.post('/predict/batch')
+async def predict_batch(request: Request):
+    """Score many users at once, sent as a JSON array of UserInput objects or as CSV
+    (a ``text/csv`` body, or a multipart upload in a ``file`` field) with the same columns."""
+    mv = current_model()
+    content_type = request.headers.get('content-type', '')
+    try:
+        with phase('validation'):
+            if content_type.startswith('multipart/form-data'):
+                form = await request.form()
+                rows = pd.read_csv(io.BytesIO(await form['file'].read())).to_dict('records')
+            elif content_type.startswith('text/csv'):
+                rows = pd.read_csv(io.BytesIO(await request.body())).to_dict('records')
+            else:
+                rows = await request.json()
+            users = user_batch.validate_python(rows)
+    except ValidationError as e:
+        return JSONResponse(status_code=422, content={'detail': e.errors(include_url=False, include_context=False, include_input=False)})
+    except (ValueError, KeyError) as e:
+        return JSONResponse(status_code=400, content={'detail': f'Could not read batch: {e}'})
+
+    # validated values, column by column, so feature engineering runs vectorized
+    raw = pd.DataFrame({column: [getattr(user, column) for user in users] for column in INPUT_COLUMNS})
+    results = await run_in_threadpool(predict_frame, mv, raw)
+
+    return JSONResponse(status_code=200, content={'response': results})
+
+@app.get('/health')
+def health():
+    return {'status': 'ok'}
+
+@app.get('/ready')
+def ready():
+    """200 once a model is loaded (with its load time and the module's import time), 503 until then."""
+    timings = {'import_seconds': round(IMPORT_SECONDS, 4)}
+    if registry.current is None:
+        status = 'error' if registry.error else 'loading'
+        return JSONResponse(status_code=503, content={'status': status, 'error': registry.error, **timings})
+    return {'status': 'ready', 'model': registry.current.info(), 'city_tiers': insurance_features.city_tiers.info(),
+            **timings}
 
+def require_admin(token):
+    """Admin endpoints are off unless ADMIN_TOKEN is set, and then need it in X-Admin-Token."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them")
+    if token is None or not secrets.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
 
+@app.post('/admin/reload')
+async def reload_model(x_admin_token: Optional[str] = Header(None)):
+    """Load the model file again and swap it in; in-flight requests finish on the old one."""
+    require_admin(x_admin_token)
+    try:
+        mv = await run_in_threadpool(registry.load)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reload failed, still serving the previous model: {e}")
+    return {'status': 'reloaded', 'model': mv.info()}
 
+@app.post('/admin/city-tiers/reload')
+def reload_city_tiers(x_admin_token: Optional[str] = Header(None)):
+    """Reload the city tier table now instead of waiting for the next change check."""
+    require_admin(x_admin_token)
+    table = insurance_features.city_tiers
+    if not table.reload():
+        raise HTTPException(status_code=500, detail=f"Reload failed, still using the previous table: {table.error}")
+    return {'status': 'reloaded', 'city_tiers': table.info()}
 
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
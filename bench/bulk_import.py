@@ -0,0 +1,87 @@
+"""Ingest rate of POST /patients/bulk against one POST /create per patient, and export rate.
+
+Runs the patient API in process on an empty store in a temporary directory and reports
+records/s for --patients synthetic patients sent as NDJSON and as CSV, for the first
+--create of them sent one request each, and for streaming them back out of GET /patients/bulk.
+
+    python bench/bulk_import.py --patients 100000
+    PATIENT_STORE=sqlite python bench/bulk_import.py
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic import synthetic_patients  # noqa: E402
+
+INPUT_FIELDS = ["name", "city", "age", "gender", "height", "weight"]
+
+
+def payloads(patients, prefix):
+    return [{"id": prefix + patient_id, **{name: record[name] for name in INPUT_FIELDS}}
+            for patient_id, record in patients.items()]
+
+
+def as_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, ["id", *INPUT_FIELDS], lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=100000)
+    parser.add_argument("--create", type=int, default=2000, help="patients sent one POST /create at a time")
+    parser.add_argument("--chunk", type=int, default=1000, help="rows per validated and committed chunk")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="bulk-bench-"))
+    with open("patients.json", "w") as f:
+        json.dump({}, f)
+    from fastapi.testclient import TestClient
+    import main as api
+
+    patients = synthetic_patients(args.patients)
+    print(f"{args.patients} patients, {type(api.store._target).__name__}, chunks of {args.chunk}")
+    print(f"{'method':<28} {'records':>9} {'seconds':>8} {'records/s':>10}")
+
+    def report(name, n, seconds):
+        print(f"{name:<28} {n:>9} {seconds:>8.2f} {n / seconds:>10.0f}")
+
+    with TestClient(api.app) as client:
+        single = payloads(dict(list(patients.items())[:args.create]), "S")
+        start = time.perf_counter()
+        for row in single:
+            client.post("/create", json=row).raise_for_status()
+        report("POST /create, one each", len(single), time.perf_counter() - start)
+
+        for fmt, prefix, content_type, encode in (
+            ("ndjson", "N", "application/x-ndjson", lambda rows: b"".join(json.dumps(row).encode() + b"\n" for row in rows)),
+            ("csv", "C", "text/csv", as_csv),
+        ):
+            body = encode(payloads(patients, prefix))
+            start = time.perf_counter()
+            response = client.post(f"/patients/bulk?chunk={args.chunk}", content=body, headers={"content-type": content_type})
+            response.raise_for_status()
+            summary = response.json()
+            assert summary["accepted"] == args.patients, summary
+            report(f"POST /patients/bulk ({fmt})", summary["accepted"], time.perf_counter() - start)
+
+        for fmt in ("ndjson", "csv"):
+            start = time.perf_counter()
+            with client.stream("GET", f"/patients/bulk?format={fmt}") as response:
+                lines = sum(chunk.count(b"\n") for chunk in response.iter_bytes())
+            report(f"GET /patients/bulk ({fmt})", lines - (fmt == "csv"), time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Check that the compiled inference path matches the sklearn pipeline.
+
+Scores every row of exp_notebook/insurance.csv (optionally repeated with random
+perturbations) through ``model.predict_proba`` on a DataFrame and through
+CompiledModel, both row by row and as one frame, and compares the results.
+
+    python bench/check_parity.py --extra 10000
+"""
+import argparse
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from compiled_model import CompiledModel  # noqa: E402
+from insurance_features import FEATURE_COLUMNS, engineer_features  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.path.join(ROOT, "exp_notebook", "model.pkl"))
+    parser.add_argument("--data", default=os.path.join(ROOT, "exp_notebook", "insurance.csv"))
+    parser.add_argument("--extra", type=int, default=10000, help="additional perturbed rows to check")
+    args = parser.parse_args()
+
+    with open(args.model, "rb") as f:
+        pipeline = pickle.load(f)
+    compiled = CompiledModel(pipeline)
+
+    raw = pd.read_csv(args.data)
+    if args.extra:
+        rng = np.random.default_rng(0)
+        extra = raw.sample(args.extra, replace=True, random_state=0).reset_index(drop=True)
+        extra["weight"] = extra["weight"] * rng.uniform(0.8, 1.2, len(extra))
+        extra["income_lpa"] = extra["income_lpa"] * rng.uniform(0.5, 1.5, len(extra))
+        extra["age"] = rng.integers(1, 120, len(extra))
+        raw = pd.concat([raw, extra], ignore_index=True)
+    features = engineer_features(raw)[FEATURE_COLUMNS]
+
+    start = time.perf_counter()
+    expected = pipeline.predict_proba(features)
+    pipeline_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    frame = compiled.predict_proba_frame(features)
+    compiled_time = time.perf_counter() - start
+
+    rows = features.to_dict("records")
+    by_row = np.vstack([compiled.predict_proba_rows([row]) for row in rows[:2000]])
+
+    ok = True
+    for name, got, want in (("frame", frame, expected), ("row by row", by_row, expected[:len(by_row)])):
+        max_diff = float(np.abs(got - want).max())
+        same_class = bool((got.argmax(axis=1) == want.argmax(axis=1)).all())
+        print(f"{name:<11} rows={len(got):<7} max |diff|={max_diff:.2e} same predicted class: {same_class}")
+        ok &= max_diff < 1e-9 and same_class
+    print(f"pipeline {pipeline_time * 1e3:.1f} ms, compiled {compiled_time * 1e3:.1f} ms for {len(features)} rows")
+    print("OK" if ok else "MISMATCH")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
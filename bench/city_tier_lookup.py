@@ -0,0 +1,68 @@
+"""Cost of one city tier lookup as the table grows, against the old list membership test.
+
+Builds tier tables of --sizes synthetic locations (plus the real ones) and times
+lookups of a tier 1 city, a tier 2 city, the last listed location, an alias and an
+unknown city.
+
+    python bench/city_tier_lookup.py --sizes 100 10000 100000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import json  # noqa: E402
+import tempfile  # noqa: E402
+
+from insurance_features import CityTiers  # noqa: E402
+
+PROBES = {"tier 1": "Mumbai", "tier 2": "Siliguri", "alias": " bengaluru ", "unknown": "Shimla"}
+
+
+def table_data(size):
+    with open("city_tiers.json") as f:
+        data = json.load(f)
+    data["tiers"]["2"] = data["tiers"]["2"] + [f"Town {i}" for i in range(size)]
+    return data
+
+
+def load_table(data, directory):
+    path = os.path.join(directory, f"tiers_{len(data['tiers']['2'])}.json")
+    with open(path, "w") as f:
+        json.dump(data, f)
+    return CityTiers(path, check_interval=float("inf"))
+
+
+def per_call(fn, arg, number):
+    return min(timeit.repeat(lambda: fn(arg), number=number, repeat=5)) / number * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[0, 1000, 10000, 100000])
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'locations':>10} {'probe':<12} {'dict ns':>9} {'list ns':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            data = table_data(size)
+            table = load_table(data, directory)
+            tier_1, tier_2 = data["tiers"]["1"], data["tiers"]["2"]
+
+            def old(city):  # the previous UserInput.city_tier
+                return 1 if city in tier_1 else 2 if city in tier_2 else 3
+
+            probes = dict(PROBES, last=tier_2[-1])
+            for name, city in probes.items():
+                new_ns = per_call(table.tier, city, args.number)
+                old_ns = per_call(old, city, max(1, args.number // max(1, size // 100)))  # the list scan is slow
+                print(f"{table.info()['entries']:>10} {name:<12} {new_ns:>9.0f} {old_ns:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Throughput of the thread and process inference backends at several concurrency levels.
+
+Each of ``--concurrency`` client threads scores batches of ``--rows`` random rows
+back to back for ``--seconds``, once against the model in this process (what
+INFERENCE_BACKEND=thread does) and once through an InferencePool (what
+INFERENCE_BACKEND=process does).
+
+    python bench/inference_backends.py --processes 4 --concurrency 1 4 16 --rows 64
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from inference_pool import InferencePool, PoolSaturated  # noqa: E402
+from insurance_features import engineer_features  # noqa: E402
+from model_registry import ModelRegistry  # noqa: E402
+from synthetic import random_user  # noqa: E402
+
+
+def run(score, batches, concurrency, seconds):
+    """Rows/s, latency percentiles and rejected calls for ``concurrency`` threads calling ``score``."""
+    latencies = []
+    rejected = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client(i):
+        mine = []
+        n = 0
+        while time.perf_counter() < deadline:
+            batch = batches[(i + n) % len(batches)]
+            n += 1
+            start = time.perf_counter()
+            try:
+                score(batch)
+            except PoolSaturated:
+                with lock:
+                    rejected[0] += 1
+                continue
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    ms = np.array(latencies) * 1e3
+    rows = len(latencies) * len(batches[0])
+    return rows / elapsed, np.percentile(ms, 50), np.percentile(ms, 99), rejected[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--rows", type=int, default=64, help="rows per scoring call (the /predict micro-batch size)")
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--model", default="exp_notebook/model.pkl")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    mv = ModelRegistry(args.model).load()
+    if mv.compiled is None:
+        sys.exit("the process backend's shared-memory path needs a compiled model")
+    batches = [engineer_features(pd.DataFrame([random_user(rng) for _ in range(args.rows)])).to_dict("records")
+               for _ in range(50)]
+
+    pool = InferencePool(args.model, processes=args.processes, acquire_timeout=5.0)
+    print(f"starting {args.processes} worker processes ...")
+    pool.start()
+    backends = {
+        "thread": lambda rows: mv.compiled.predict_proba_rows(rows),
+        "process": lambda rows: pool.predict_proba(mv, X=mv.compiled.encode_rows(rows)),
+    }
+    expected = backends["thread"](batches[0])
+    assert np.allclose(backends["process"](batches[0]), expected), "process backend disagrees with thread backend"
+
+    print(f"{'backend':<8} {'clients':>7} {'rows/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'503s':>6}")
+    try:
+        for concurrency in args.concurrency:
+            for name, score in backends.items():
+                rate, p50, p99, rejected = run(score, batches, concurrency, args.seconds)
+                print(f"{name:<8} {concurrency:>7} {rate:>10.0f} {p50:>8.2f} {p99:>8.2f} {rejected:>6}")
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
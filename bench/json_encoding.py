@@ -0,0 +1,123 @@
+"""JSON encoding cost of patient payloads: the current path against the FAST_JSON backends.
+
+Times, for --patients synthetic records:
+  * a full /view body: FastAPI's default (jsonable_encoder, then json.dumps),
+    JSONResponse without jsonable_encoder, pydantic-core and orjson (if installed)
+  * saving and loading a patients.json snapshot, and encoding journal lines
+  * GET /view end to end through the app, with FAST_JSON off and on
+
+    python bench/json_encoding.py --patients 100000
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pydantic_core  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from synthetic import synthetic_patients  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def best(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1e3
+
+
+def report(title, rows, repeat):
+    print(f"\n{title}")
+    baseline = None
+    for name, fn in rows:
+        if fn is None:
+            print(f"  {name:<44} {'n/a':>9}")
+            continue
+        ms = best(fn, repeat)
+        baseline = baseline or ms
+        print(f"  {name:<44} {ms:>9.1f} ms  {baseline / ms:>5.1f}x")
+
+
+def end_to_end(patients, repeat):
+    """GET /view (all patients) through the app in a child process, per FAST_JSON setting."""
+    workdir = tempfile.mkdtemp(prefix="json-bench-")
+    with open(os.path.join(workdir, "patients.json"), "w") as f:
+        json.dump(patients, f)
+    child = (
+        "import sys, time; sys.path.insert(0, %r)\n"
+        "from fastapi.testclient import TestClient\n"
+        "import main\n"
+        "with TestClient(main.app) as client:\n"
+        "    client.get('/view')\n"
+        "    times = []\n"
+        "    for _ in range(%d):\n"
+        "        start = time.perf_counter(); client.get('/view').raise_for_status()\n"
+        "        times.append(time.perf_counter() - start)\n"
+        "print(min(times) * 1e3)\n"
+    ) % (ROOT, repeat)
+    print("\nGET /view end to end")
+    for setting in ("0", "1"):
+        out = subprocess.run([sys.executable, "-c", child], cwd=workdir, capture_output=True, text=True,
+                             env=dict(os.environ, FAST_JSON=setting, PATIENT_STORE="json"))
+        if out.returncode:
+            sys.exit(out.stderr)
+        print(f"  FAST_JSON={setting:<35} {float(out.stdout):>9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    patients = synthetic_patients(args.patients)
+    print(f"{args.patients} patients, best of {args.repeat}; orjson {'installed' if orjson else 'not installed'}")
+
+    response = JSONResponse.__new__(JSONResponse)  # only render() is used
+    orjson_options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY if orjson else None
+    report("/view response body", [
+        ("jsonable_encoder + json.dumps (FastAPI)", lambda: response.render(jsonable_encoder(patients))),
+        ("JSONResponse, no jsonable_encoder", lambda: response.render(patients)),
+        ("pydantic_core.to_json", lambda: pydantic_core.to_json(patients, fallback=str, inf_nan_mode="null")),
+        ("orjson.dumps", orjson and (lambda: orjson.dumps(patients, default=str, option=orjson_options))),
+    ], args.repeat)
+
+    text = json.dumps(patients, default=str)
+    report("patients.json snapshot save", [
+        ("json.dump(default=str)", lambda: json.dump(patients, io.StringIO(), default=str)),
+        ("pydantic_core.to_json", lambda: io.BytesIO().write(pydantic_core.to_json(patients, fallback=str))),
+        ("orjson.dumps", orjson and (lambda: io.BytesIO().write(orjson.dumps(patients, default=str)))),
+    ], args.repeat)
+    report("patients.json snapshot load", [
+        ("json.load", lambda: json.load(io.StringIO(text))),
+        ("pydantic_core.from_json", lambda: pydantic_core.from_json(text.encode())),
+        ("orjson.loads", orjson and (lambda: orjson.loads(text.encode()))),
+    ], args.repeat)
+
+    entries = [{"op": "put", "id": patient_id, "record": record} for patient_id, record in patients.items()]
+    report("journal lines (one per patient)", [
+        ("json.dumps(default=str).encode()", lambda: [json.dumps(e, default=str).encode() for e in entries]),
+        ("pydantic_core.to_json", lambda: [pydantic_core.to_json(e, fallback=str) for e in entries]),
+        ("orjson.dumps", orjson and (lambda: [orjson.dumps(e, default=str) for e in entries])),
+    ], args.repeat)
+
+    end_to_end(patients, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
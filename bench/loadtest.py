@@ -0,0 +1,289 @@
+"""Latency, throughput and memory benchmark for both APIs, with baseline comparison.
+
+Generates a synthetic patients.json of --patients records and random /predict
+payloads, then drives every endpoint of main.py and app.py with --concurrency
+concurrent clients, in-process through the ASGI transport and/or over HTTP
+against local uvicorn servers. For each endpoint it reports throughput,
+p50/p95/p99 latency and the peak RSS of the serving process(es).
+
+    python bench/loadtest.py --patients 100000 --requests 2000 --output bench/results.json
+    python bench/loadtest.py --baseline bench/results.json --max-regression 0.2   # exits 1 on a regression
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpx  # noqa: E402
+import numpy as np  # noqa: E402
+import psutil  # noqa: E402
+
+from synthetic import PATIENT_CITIES, random_user, synthetic_patients  # noqa: E402
+
+
+def scenarios(patient_ids, rng):
+    """(app, endpoint label, request factory) for every benchmarked endpoint; writes come last."""
+    users = [random_user(rng) for _ in range(1000)]
+    created = iter(range(10 ** 9))
+    return [
+        ("main", "GET /patient/{id}", lambda: ("GET", f"/patient/{rng.choice(patient_ids)}", None)),
+        ("main", "GET /view?limit=100", lambda: ("GET", "/view?limit=100", None)),
+        ("main", "GET /sort?sort_by=bmi&limit=50", lambda: ("GET", "/sort?sort_by=bmi&order=desc&limit=50", None)),
+        ("main", "GET /patients/search", lambda: ("GET", f"/patients/search?city={rng.choice(PATIENT_CITIES)}&limit=50",
+                                                  None)),
+        ("main", "POST /create", lambda: ("POST", "/create", {
+            "id": f"LOAD-{next(created)}", "name": "Load Test", "city": rng.choice(PATIENT_CITIES),
+            "age": rng.randint(1, 99), "gender": "other", "height": 1.7, "weight": round(rng.uniform(40, 130), 1)})),
+        ("main", "PUT /edit/{id}", lambda: ("PUT", f"/edit/{rng.choice(patient_ids)}",
+                                            {"weight": round(rng.uniform(40, 130), 1)})),
+        ("app", "GET /health", lambda: ("GET", "/health", None)),
+        ("app", "POST /predict", lambda: ("POST", "/predict", rng.choice(users))),
+        ("app", "POST /predict/batch (100 rows)", lambda: ("POST", "/predict/batch", rng.sample(users, 100))),
+    ]
+
+
+# measuring
+
+class PeakRSS:
+    """Samples the resident memory of ``pid`` and its children every ``interval`` seconds, keeping the maximum."""
+
+    def __init__(self, pid, interval=0.05):
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        total = 0
+        for process in [self.process] + self.process.children(recursive=True):
+            try:
+                total += process.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        self.peak = max(self.peak, total)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+async def drive(client, make_request, total, concurrency):
+    """Send ``total`` requests from ``concurrency`` concurrent clients; latencies in seconds and error count."""
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            method, url, body = make_request()
+            start = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies, errors
+
+
+async def run_endpoint(client, pid, target, app_name, label, make_request, args):
+    await drive(client, make_request, min(args.warmup, args.requests), args.concurrency)
+    with PeakRSS(pid) as rss:
+        start = time.perf_counter()
+        latencies, errors = await drive(client, make_request, args.requests, args.concurrency)
+        elapsed = time.perf_counter() - start
+    ms = np.array(latencies) * 1e3
+    result = {
+        "target": target, "app": app_name, "endpoint": label, "requests": len(latencies), "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "peak_rss_mb": round(rss.peak / 2 ** 20, 1),
+    }
+    print(f"{target:<8} {app_name:<5} {label:<32} {result['throughput_rps']:>9.0f} {result['p50_ms']:>8.2f} "
+          f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['peak_rss_mb']:>8.0f} {errors:>6}")
+    return result
+
+
+# targets
+
+async def run_asgi(selected, args):
+    """Drive both apps in this process through httpx's ASGI transport (no sockets, no server)."""
+    import app as prediction_app
+    import main as patient_app
+    apps = {"main": patient_app.app, "app": prediction_app.app}
+    results = []
+    for name, asgi_app in apps.items():
+        todo = [s for s in selected if s[0] == name]
+        if not todo:
+            continue
+        async with asgi_app.router.lifespan_context(asgi_app):
+            transport = httpx.ASGITransport(app=asgi_app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for app_name, label, make_request in todo:
+                    results.append(await run_endpoint(client, os.getpid(), "asgi", app_name, label, make_request, args))
+    return results
+
+
+def start_uvicorn(module, port, workers, ready_path, env):
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{module}:app", "--app-dir", ROOT, "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(300):
+        try:
+            if httpx.get(url + ready_path, timeout=0.5).status_code == 200:
+                return proc, url
+        except httpx.TransportError:
+            pass
+        if proc.poll() is not None:
+            break
+        time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError(f"uvicorn {module}:app did not start")
+
+
+async def run_uvicorn(selected, args):
+    """Drive both apps over HTTP against ``uvicorn --workers N`` processes on localhost."""
+    results = []
+    for offset, (name, ready_path) in enumerate([("main", "/"), ("app", "/ready")]):
+        todo = [s for s in selected if s[0] == name]
+        if not todo:
+            continue
+        proc, url = start_uvicorn(name, args.port + offset, args.workers, ready_path, dict(os.environ))
+        try:
+            limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+                for app_name, label, make_request in todo:
+                    results.append(await run_endpoint(client, proc.pid, "uvicorn", app_name, label, make_request, args))
+        finally:
+            proc.terminate()
+            proc.wait()
+    return results
+
+
+# baseline comparison
+
+def compare(results, baseline, tolerance):
+    """Regressions against ``baseline``: p95 latency up or throughput down by more than ``tolerance``."""
+    before = {(r["target"], r["app"], r["endpoint"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\n{'endpoint':<48} {'p95 ms':>17} {'rps':>17}")
+    for r in results:
+        old = before.get((r["target"], r["app"], r["endpoint"]))
+        if old is None:
+            continue
+        p95 = r["p95_ms"] / old["p95_ms"] - 1 if old["p95_ms"] else 0.0
+        rps = r["throughput_rps"] / old["throughput_rps"] - 1 if old["throughput_rps"] else 0.0
+        bad = p95 > tolerance or rps < -tolerance
+        print(f"{r['target'] + ' ' + r['app'] + ' ' + r['endpoint']:<48} {old['p95_ms']:>7.2f} -> {r['p95_ms']:>7.2f}"
+              f" {old['throughput_rps']:>7.0f} -> {r['throughput_rps']:>7.0f}  {'REGRESSION' if bad else 'ok'}")
+        if bad:
+            regressions.append(r)
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=1000, help="synthetic patient records (1k to 1M)")
+    parser.add_argument("--store", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--targets", nargs="+", choices=["asgi", "uvicorn"], default=["asgi", "uvicorn"])
+    parser.add_argument("--apps", nargs="+", choices=["main", "app"], default=["main", "app"])
+    parser.add_argument("--endpoints", nargs="*", help="only endpoints whose label contains one of these strings")
+    parser.add_argument("--requests", type=int, default=1000, help="timed requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results here as JSON")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="fail if p95 grows or throughput drops by more than this fraction")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    start = time.perf_counter()
+    patients = synthetic_patients(args.patients, args.seed)
+    with open(os.path.join(workdir, "patients.json"), "w") as f:
+        json.dump(patients, f)
+    print(f"{args.patients} synthetic patients in {time.perf_counter() - start:.1f}s -> {workdir}")
+
+    # both apps run with the throw-away data directory as their working directory
+    os.chdir(workdir)
+    os.environ["PATIENT_STORE"] = args.store
+    os.environ.setdefault("MODEL_PATH", os.path.join(ROOT, "exp_notebook", "model.pkl"))
+    os.environ.setdefault("MODEL_WATCH_INTERVAL", "0")
+
+    selected = [s for s in scenarios(list(patients), rng) if s[0] in args.apps
+                and (not args.endpoints or any(part in s[1] for part in args.endpoints))]
+    del patients
+
+    print(f"{'target':<8} {'app':<5} {'endpoint':<32} {'rps':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'rss MB':>8} {'errors':>6}")
+    results = []
+    if "asgi" in args.targets:
+        results += asyncio.run(run_asgi(selected, args))
+    if "uvicorn" in args.targets:
+        results += asyncio.run(run_uvicorn(selected, args))
+
+    report = {
+        "meta": {
+            "commit": git_commit(), "time": time.time(), "python": platform.python_version(),
+            "platform": platform.platform(), "cpus": os.cpu_count(), "patients": args.patients,
+            "store": args.store, "requests": args.requests, "concurrency": args.concurrency, "workers": args.workers,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(os.path.join(ROOT, args.output) if not os.path.isabs(args.output) else args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    failed = [r for r in results if r["errors"]]
+    if args.baseline:
+        path = os.path.join(ROOT, args.baseline) if not os.path.isabs(args.baseline) else args.baseline
+        with open(path) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        if regressions:
+            print(f"\n{len(regressions)} endpoint(s) regressed by more than {args.max_regression:.0%}")
+            sys.exit(1)
+    if failed:
+        print(f"\n{len(failed)} endpoint(s) returned errors")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Cost of the /stats aggregates over the patient dicts against the NumPy columns.
+
+For --patients synthetic records, times BMI mean/percentiles per city, the verdict
+counts and the age histogram computed with a loop over the dicts (what a handler
+would do without the column table) and with PatientColumns.stats(), and reports
+the memory per patient of both layouts.
+
+    python bench/patient_stats.py --patients 1000000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from patient_columns import PatientColumns, MEMORY_SAMPLE  # noqa: E402
+from synthetic import synthetic_patients  # noqa: E402
+
+
+def dict_stats(data, percentiles=(50, 90, 99), age_bin=10):
+    by_city = defaultdict(list)
+    verdicts, ages = Counter(), Counter()
+    for record in data.values():
+        by_city[record["city"]].append(record["bmi"])
+        verdicts[record["verdict"]] += 1
+        ages[min(record["age"] // age_bin, 120 // age_bin - 1)] += 1
+    result = {}
+    for city, values in by_city.items():
+        cuts = statistics.quantiles(values, n=100, method="inclusive")
+        result[city] = {"count": len(values), "mean": statistics.fmean(values), **{f"p{p}": cuts[p - 1] for p in percentiles}}
+    return result, verdicts, ages
+
+
+def best(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    data = synthetic_patients(args.patients)
+    columns = PatientColumns()
+    start = time.perf_counter()
+    columns.rebuild(data)
+    print(f"{args.patients} patients; column table built in {time.perf_counter() - start:.2f}s")
+
+    loop_ms = best(lambda: dict_stats(data), args.repeat)
+    columns_ms = best(columns.stats, args.repeat)
+    print(f"  {'loop over dicts':<24} {loop_ms:>9.1f} ms")
+    print(f"  {'PatientColumns.stats()':<24} {columns_ms:>9.1f} ms  {loop_ms / columns_ms:>5.1f}x")
+
+    memory = columns.memory(list(data.values())[:MEMORY_SAMPLE])
+    print(f"memory per patient: {memory['dict_bytes_per_record']} bytes as dicts, "
+          f"{memory['columnar_bytes_per_record']} bytes as columns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Per-row cost of /predict against /predict/batch, measured in-process.
+
+    python bench/predict_throughput.py --singles 200 --batch-sizes 100 1000 10000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import app  # noqa: E402
+from synthetic import random_user  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--singles", type=int, default=200, help="number of /predict calls to time")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    client = TestClient(app.app)
+    client.__enter__()  # run the lifespan, which loads the model
+    users = [random_user(rng) for _ in range(max(args.batch_sizes + [args.singles]))]
+    client.post("/predict", json=users[0])  # warm up
+
+    start = time.perf_counter()
+    for user in users[:args.singles]:
+        client.post("/predict", json=user).raise_for_status()
+    single = (time.perf_counter() - start) / args.singles
+    print(f"{'/predict':<22} {single * 1e3:8.3f} ms/row {1 / single:10.0f} rows/s")
+
+    for size in args.batch_sizes:
+        start = time.perf_counter()
+        client.post("/predict/batch", json=users[:size]).raise_for_status()
+        per_row = (time.perf_counter() - start) / size
+        print(f"{f'/predict/batch n={size}':<22} {per_row * 1e3:8.3f} ms/row {1 / per_row:10.0f} rows/s"
+              f"   ({single / per_row:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
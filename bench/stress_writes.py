@@ -0,0 +1,111 @@
+"""Stress test for concurrent patient writes.
+
+Starts ``uvicorn main:app --workers N`` on a throw-away copy of the data, then fires
+thousands of concurrent creates and If-Match protected edits at it and checks that
+none of them were lost.
+
+    python bench/stress_writes.py --workers 4 --creates 2000 --increments 1000
+"""
+import argparse
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COUNTER_ID = "STRESS-COUNTER"
+
+
+def start_server(workdir, port, workers, store):
+    for name in glob.glob(os.path.join(ROOT, "*.py")) + [os.path.join(ROOT, "patients.json")]:
+        shutil.copy(name, workdir)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=workdir, env=dict(os.environ, PATIENT_STORE=store),
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(url + "/", timeout=0.5)
+            return proc, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("server did not start")
+
+
+def create(session, url, i):
+    patient = {"id": f"STRESS-{i}", "name": "Stress Test", "city": "Pune", "age": 30,
+               "gender": "other", "height": 1.7, "weight": 70.0}
+    return session.post(url + "/create", json=patient).status_code
+
+
+def increment(session, url):
+    # optimistic update: read the ETag, send it back with If-Match, retry if someone else won
+    retries = 0
+    while True:
+        r = session.get(f"{url}/patient/{COUNTER_ID}")
+        weight = r.json()["weight"]
+        r = session.put(f"{url}/edit/{COUNTER_ID}", json={"weight": weight + 1}, headers={"If-Match": r.headers["ETag"]})
+        if r.status_code == 200:
+            return retries
+        assert r.status_code == 412, r.text
+        retries += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="uvicorn worker processes")
+    parser.add_argument("--clients", type=int, default=64, help="concurrent client threads")
+    parser.add_argument("--creates", type=int, default=2000)
+    parser.add_argument("--increments", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--store", choices=["json", "sqlite"], default="json", help="storage backend to test")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="stress-")
+    proc, url = start_server(workdir, args.port, args.workers, args.store)
+    sessions = {}
+
+    def session():
+        # one keep-alive session per client thread
+        return sessions.setdefault(threading.get_ident(), requests.Session())
+
+    try:
+        s = requests.Session()
+        s.post(url + "/create", json={"id": COUNTER_ID, "name": "Counter", "city": "Pune", "age": 30,
+                                      "gender": "other", "height": 1.0, "weight": 1.0})
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.clients) as pool:
+            creates = [pool.submit(lambda i=i: create(session(), url, i)) for i in range(args.creates)]
+            increments = [pool.submit(lambda: increment(session(), url)) for _ in range(args.increments)]
+            statuses = [f.result() for f in creates]
+            retries = sum(f.result() for f in increments)
+        elapsed = time.perf_counter() - start
+
+        data = s.get(url + "/view").json()
+        missing = [i for i in range(args.creates) if f"STRESS-{i}" not in data]
+        weight = data[COUNTER_ID]["weight"]
+        print(f"{args.creates + args.increments} mutations in {elapsed:.2f}s "
+              f"({(args.creates + args.increments) / elapsed:.0f}/s), {retries} If-Match retries")
+        print(f"creates: {statuses.count(201)} ok, {len(missing)} missing")
+        print(f"counter: {weight:.0f} (expected {1 + args.increments})")
+        ok = not missing and statuses.count(201) == args.creates and weight == 1 + args.increments
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("OK" if ok else "LOST UPDATES")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Synthetic inputs shared by the benchmark scripts: /predict payloads and patient records."""
+import numpy as np
+
+from insurance_features import city_tiers
+
+OCCUPATIONS = ['retired', 'freelancer', 'student', 'government_job', 'business_owner', 'unemployed', 'private_job']
+CITIES = city_tiers.cities(1) + city_tiers.cities(2) + ["Shimla", "Ooty"]
+
+
+def random_user(rng):
+    return {
+        "age": rng.randint(18, 80),
+        "weight": round(rng.uniform(45, 120), 1),
+        "height": round(rng.uniform(1.45, 2.0), 2),
+        "income_lpa": round(rng.uniform(1, 50), 2),
+        "smoker": rng.random() < 0.3,
+        "city": rng.choice(CITIES),
+        "occupation": rng.choice(OCCUPATIONS),
+    }
+
+
+PATIENT_CITIES = ["Mumbai", "Delhi", "Pune", "Guwahati", "Jaipur", "Chennai", "Shimla", "Kolkata", "Indore", "Surat"]
+FIRST = ["Ananya", "Ravi", "Sneha", "Arjun", "Neha", "Karan", "Priya", "Vikram", "Isha", "Rahul"]
+LAST = ["Verma", "Mehta", "Kulkarni", "Singh", "Sharma", "Iyer", "Das", "Reddy", "Nair", "Gupta"]
+
+
+def verdict(bmi):
+    if bmi < 18.5:
+        return "Underweight"
+    elif bmi < 24.9:
+        return "Normal weight"
+    elif bmi < 29.9:
+        return "Overweight"
+    return "Obesity"
+
+
+def synthetic_patients(n, seed=0):
+    """``n`` patients in the patients.json format, generated column-wise so 1M records take seconds."""
+    rng = np.random.default_rng(seed)
+    height = np.round(rng.uniform(1.45, 2.0, n), 2)
+    weight = np.round(rng.uniform(40, 130, n), 1)
+    bmi = np.round(weight / height ** 2, 2)
+    ages = rng.integers(1, 100, n).tolist()
+    genders = rng.choice(["male", "female", "other"], n).tolist()
+    cities = rng.choice(PATIENT_CITIES, n).tolist()
+    first, last = rng.choice(FIRST, n).tolist(), rng.choice(LAST, n).tolist()
+    height, weight, bmi = height.tolist(), weight.tolist(), bmi.tolist()
+    return {
+        f"P{i:07d}": {"name": f"{first[i]} {last[i]}", "city": cities[i], "age": ages[i], "gender": genders[i],
+                      "height": height[i], "weight": weight[i], "bmi": bmi[i], "verdict": verdict(bmi[i])}
+        for i in range(n)
+    }
@@ -0,0 +1,127 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+class CompiledModel:
+    """The OneHotEncoder + RandomForest pipeline from ``model.pkl``, flattened for serving.
+
+    The fitted encoder categories and the trees are read out of the pipeline once.
+    Feature rows are then one-hot encoded straight into a float32 NumPy matrix (a
+    reused per-thread buffer for the small batches ``/predict`` sends), and every tree
+    is evaluated with ``tree_.apply`` plus a precomputed leaf probability table. That
+    skips the DataFrame, the ColumnTransformer dispatch and the forest's per-call
+    input checks and thread pool, and gives the same probabilities as
+    ``pipeline.predict_proba``.
+
+    Raises ``ValueError`` for pipelines of any other shape; callers keep using the
+    pipeline itself then.
+    """
+
+    def __init__(self, pipeline):
+        # imported here so importing the app doesn't pay for sklearn before the model is loaded
+        from sklearn.compose import ColumnTransformer
+        from sklearn.ensemble import RandomForestClassifier
+        from sklearn.pipeline import Pipeline
+        from sklearn.preprocessing import OneHotEncoder
+
+        if not isinstance(pipeline, Pipeline) or len(pipeline.steps) != 2:
+            raise ValueError("expected Pipeline([preprocessor, classifier])")
+        preprocessor, forest = pipeline.steps[0][1], pipeline.steps[1][1]
+        if not isinstance(preprocessor, ColumnTransformer) or not isinstance(forest, RandomForestClassifier):
+            raise ValueError("expected a ColumnTransformer followed by a RandomForestClassifier")
+        if forest.n_outputs_ != 1:
+            raise ValueError("multi-output forests are not supported")
+
+        # (feature, {category: column}) for one-hot columns, (feature, column) for passthrough ones
+        self.categorical = []
+        self.numeric = []
+        for name, transformer, columns in preprocessor.transformers_:
+            if name == "remainder" and transformer == "drop":
+                continue
+            block = preprocessor.output_indices_[name]
+            if isinstance(transformer, OneHotEncoder):
+                if transformer.drop is not None:
+                    raise ValueError("OneHotEncoder(drop=...) is not supported")
+                offset = block.start
+                for feature, categories in zip(columns, transformer.categories_):
+                    self.categorical.append((feature, categories, {c.item() if hasattr(c, "item") else c: offset + i
+                                                                   for i, c in enumerate(categories)}))
+                    offset += len(categories)
+            elif transformer == "passthrough" or getattr(transformer, "feature_names_out", None) == "one-to-one" \
+                    and getattr(transformer, "func", None) is None:
+                self.numeric.extend((feature, block.start + i) for i, feature in enumerate(columns))
+            else:
+                raise ValueError(f"unsupported transformer {name!r}")
+        self.width = forest.n_features_in_
+        self.classes_ = forest.classes_
+
+        # per tree: the fitted tree structure and each leaf's normalized class probabilities
+        self.trees = []
+        for tree in forest.estimators_:
+            value = tree.tree_.value[:, 0, :forest.n_classes_].astype(np.float64)
+            total = value.sum(axis=1, keepdims=True)
+            total[total == 0.0] = 1.0
+            self.trees.append((tree.tree_, value / total))
+        self._local = threading.local()
+
+    # encoding
+
+    def _buffer(self, n):
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None or buffer.shape[0] < n:
+            buffer = self._local.buffer = np.zeros((max(n, 64), self.width), dtype=np.float32)
+        X = buffer[:n]
+        X.fill(0.0)
+        return X
+
+    def encode_rows(self, rows):
+        """One-hot encode a list of feature dicts (as built from ``UserInput``)."""
+        X = self._buffer(len(rows))
+        for r, row in enumerate(rows):
+            for feature, _, lookup in self.categorical:
+                try:
+                    X[r, lookup[row[feature]]] = 1.0
+                except KeyError:
+                    raise ValueError(f"Found unknown category {row[feature]!r} in column {feature!r}")
+            for feature, column in self.numeric:
+                X[r, column] = row[feature]
+        return X
+
+    def encode_frame(self, features):
+        """One-hot encode a feature DataFrame column by column (used for large batches)."""
+        n = len(features)
+        X = np.zeros((n, self.width), dtype=np.float32)
+        rows = np.arange(n)
+        for feature, categories, lookup in self.categorical:
+            codes = pd.Categorical(features[feature], categories=categories).codes
+            if (codes < 0).any():
+                raise ValueError(f"Found unknown categories in column {feature!r}")
+            X[rows, min(lookup.values()) + codes] = 1.0
+        for feature, column in self.numeric:
+            X[:, column] = features[feature].to_numpy(dtype=np.float32)
+        return X
+
+    # inference
+
+    def predict_proba(self, X):
+        proba = np.zeros((X.shape[0], len(self.classes_)))
+        for tree, leaf_proba in self.trees:
+            proba += leaf_proba[tree.apply(X)]
+        proba /= len(self.trees)
+        return proba
+
+    def predict_proba_rows(self, rows):
+        return self.predict_proba(self.encode_rows(rows))
+
+    def predict_proba_frame(self, features):
+        return self.predict_proba(self.encode_frame(features))
+
+
+def compile_model(pipeline):
+    """``CompiledModel(pipeline)``, or ``None`` if the pipeline has a shape it doesn't handle."""
+    try:
+        return CompiledModel(pipeline)
+    except ValueError:
+        return None
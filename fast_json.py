@@ -0,0 +1,57 @@
+import json
+import os
+
+import pydantic_core
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional: pip install orjson
+    orjson = None
+
+# FAST_JSON=1 encodes responses, the journal and snapshots with orjson when it is installed and with
+# pydantic-core's Rust encoder otherwise. The default stays the stdlib json module, byte for byte as before.
+ENABLED = os.environ.get("FAST_JSON", "0") == "1"
+BACKEND = ("orjson" if orjson is not None else "pydantic-core") if ENABLED else "json"
+
+if BACKEND == "orjson":
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(obj):
+        return orjson.dumps(obj, default=str, option=_OPTIONS)
+
+    loads = orjson.loads
+elif BACKEND == "pydantic-core":
+    def dumps(obj):
+        return pydantic_core.to_json(obj, fallback=str, inf_nan_mode="null")
+
+    loads = pydantic_core.from_json
+else:
+    def dumps(obj):
+        return json.dumps(obj, default=str).encode()
+
+    loads = json.loads
+
+dumps.__doc__ = "``obj`` as UTF-8 JSON bytes; values JSON has no type for are written as ``str(value)``."
+
+
+def dump(obj, f):
+    """Write ``obj`` to ``f``, a file opened in binary mode."""
+    f.write(dumps(obj))
+
+
+def load(f):
+    """Read a JSON document from ``f``, a file opened in binary mode."""
+    return loads(f.read())
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse that renders with ``dumps`` when FAST_JSON is on.
+
+    Endpoints that return one directly also skip FastAPI's ``jsonable_encoder``
+    pass, which otherwise walks and copies every value before it is encoded.
+    """
+
+    if ENABLED:
+        def render(self, content):
+            return dumps(content)
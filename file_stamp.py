@@ -0,0 +1,10 @@
+import os
+
+
+def file_stamp(path):
+    """Changes whenever ``path`` is replaced or rewritten; ``None`` if it doesn't exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
@@ -1,48 +1,112 @@
+import io
+import os
+
+import pandas as pd
 import streamlit as st
 import requests
 
-API_URL = "http://127.0.0.1:8000/predict"
+from prediction_client import (DEFAULT_CHUNK_SIZE, DEFAULT_CONCURRENCY, INPUT_COLUMNS, PredictionError,
+                               make_session, predict, score_chunk, score_frame)
+
+API_URL = os.environ.get("API_URL", "http://127.0.0.1:8000")
+
+
+@st.cache_resource
+def http_session():
+    # one keep-alive connection pool for the whole app, reused across reruns and users
+    return make_session(pool_size=max(DEFAULT_CONCURRENCY, 16))
+
+
+# results are cached on their inputs, so a rerun with the same values doesn't call the API again;
+# errors raise and are never cached. The TTL matches the server's prediction cache.
+@st.cache_data(ttl=3600, show_spinner=False)
+def predict_user(api_url, user):
+    return predict(http_session(), api_url, user)
+
+
+# one entry per chunk of rows, keyed on its CSV bytes: a file scored before is served from here, and
+# so is every unchanged chunk of an edited one. It only talks to the API, never to st.* elements, since
+# those can't be replayed from the cache; the progress bar is updated by the caller. The session is
+# left out of the key (leading underscore).
+@st.cache_data(ttl=3600, show_spinner=False, max_entries=10000)
+def score_chunk_cached(_session, api_url, body):
+    return score_chunk(_session, api_url, body)
+
 
 st.title("Insurance Premium Category Predictor")
-st.markdown("Enter your details below:")
-
-# Input fields
-age = st.number_input("Age", min_value=1, max_value=119, value=30)
-weight = st.number_input("Weight (kg)", min_value=1.0, value=65.0)
-height = st.number_input("Height (m)", min_value=0.5, max_value=2.5, value=1.7)
-income_lpa = st.number_input("Annual Income (LPA)", min_value=0.1, value=10.0)
-smoker = st.selectbox("Are you a smoker?", options=[True, False])
-city = st.text_input("City", value="Mumbai")
-occupation = st.selectbox(
-    "Occupation",
-    ['retired', 'freelancer', 'student', 'government_job', 'business_owner', 'unemployed', 'private_job']
-)
-
-if st.button("Predict Premium Category"):
-    input_data = {
-        "age": age,
-        "weight": weight,
-        "height": height,
-        "income_lpa": income_lpa,
-        "smoker": smoker,
-        "city": city,
-        "occupation": occupation
-    }
-
-    try:
-        response = requests.post(API_URL, json=input_data)
-        result = response.json()
-
-        if response.status_code == 200 and "response" in result:
-            prediction = result["response"]
+single, batch = st.tabs(["Single prediction", "Batch (CSV)"])
+
+with single:
+    st.markdown("Enter your details below:")
+
+    # Input fields
+    age = st.number_input("Age", min_value=1, max_value=119, value=30)
+    weight = st.number_input("Weight (kg)", min_value=1.0, value=65.0)
+    height = st.number_input("Height (m)", min_value=0.5, max_value=2.5, value=1.7)
+    income_lpa = st.number_input("Annual Income (LPA)", min_value=0.1, value=10.0)
+    smoker = st.selectbox("Are you a smoker?", options=[True, False])
+    city = st.text_input("City", value="Mumbai")
+    occupation = st.selectbox(
+        "Occupation",
+        ['retired', 'freelancer', 'student', 'government_job', 'business_owner', 'unemployed', 'private_job']
+    )
+
+    if st.button("Predict Premium Category"):
+        input_data = {
+            "age": age,
+            "weight": weight,
+            "height": height,
+            "income_lpa": income_lpa,
+            "smoker": smoker,
+            "city": city,
+            "occupation": occupation
+        }
+
+        try:
+            prediction = predict_user(API_URL, input_data)
             st.success(f"Predicted Insurance Premium Category: **{prediction['predicted_category']}**")
             st.write("🔍 Confidence:", prediction["confidence"])
             st.write("📊 Class Probabilities:")
             st.json(prediction["class_probabilities"])
 
-        else:
-            st.error(f"API Error: {response.status_code}")
-            st.write(result)
+        except PredictionError as e:
+            st.error(f"API Error: {e.status_code}")
+            st.write(e.detail)
+
+        except requests.exceptions.ConnectionError:
+            st.error("❌ Could not connect to the FastAPI server. Make sure it's running.")
+
+with batch:
+    st.markdown(f"Upload a CSV with the columns `{'`, `'.join(INPUT_COLUMNS)}`, one user per row. "
+                "Other columns are kept in the results.")
+    upload = st.file_uploader("CSV file", type=["csv"])
+    chunk_size = st.number_input("Rows per request", min_value=1, max_value=10000, value=DEFAULT_CHUNK_SIZE)
+    concurrency = st.slider("Parallel requests", min_value=1, max_value=16, value=DEFAULT_CONCURRENCY)
+
+    if upload is not None and st.button("Score file"):
+        progress = st.progress(0.0, text="Scoring ...")
+
+        def on_progress(done, total):
+            progress.progress(done / total, text=f"Scored {done:,} of {total:,} rows")
+
+        try:
+            frame = pd.read_csv(io.BytesIO(upload.getvalue()))
+            scored = score_frame(http_session(), API_URL, frame, int(chunk_size), concurrency, on_progress,
+                                 score=score_chunk_cached)
+            progress.progress(1.0, text=f"Scored {len(scored):,} rows")
+            rejected = int((scored["error"] != "").sum())
+            if rejected:
+                st.warning(f"{rejected:,} rows were rejected; see the `error` column.")
+            st.dataframe(scored.head(1000))
+            st.download_button("Download results (CSV)", scored.to_csv(index=False).encode(),
+                               file_name=f"scored_{upload.name}", mime="text/csv")
+
+        except ValueError as e:
+            st.error(f"Could not read the file: {e}")
+
+        except PredictionError as e:
+            st.error(f"API Error: {e.status_code}")
+            st.write(e.detail)
 
-    except requests.exceptions.ConnectionError:
-        st.error("❌ Could not connect to the FastAPI server. Make sure it's running.")
\ No newline at end of file
+        except requests.exceptions.ConnectionError:
+            st.error("❌ Could not connect to the FastAPI server. Make sure it's running.")
@@ -0,0 +1,235 @@
+import multiprocessing
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class PoolSaturated(Exception):
+    """Every shared-memory slot stayed busy for longer than the pool's acquire timeout."""
+
+
+class _Slot:
+    """A shared-memory block holding one chunk's float32 input matrix followed by its float64 output."""
+
+    def __init__(self, nbytes):
+        self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def fits(self, nbytes):
+        return self.shm.size >= nbytes
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _layout(rows, width, n_classes):
+    """Byte offset of the output matrix and total size of a slot for ``rows`` rows."""
+    out_offset = -(-rows * width * 4 // 8) * 8  # float32 input, rounded up so the float64 output is aligned
+    return out_offset, out_offset + rows * n_classes * 8
+
+
+# worker process state: the model registry and the shared-memory blocks it has attached to
+
+_registry = None
+_loaded_for = None
+_attached = {}
+
+
+def _init_worker(path, mmap):
+    global _registry
+    from model_registry import ModelRegistry
+    _registry = ModelRegistry(path, mmap=mmap, compile=True)
+    _use_model(path, None)
+
+
+def _use_model(path, stamp):
+    """The worker's model, reloaded when the parent has moved on to another file or version."""
+    global _loaded_for
+    if _registry.current is None or _loaded_for != (path, stamp) and _registry.current.stamp != stamp:
+        _registry.load(path)
+    _loaded_for = (path, stamp)
+    return _registry.current
+
+
+def _attach(name):
+    shm = _attached.get(name)
+    if shm is None:
+        shm = _attached[name] = shared_memory.SharedMemory(name=name)
+    return shm
+
+
+def _worker_ping():
+    return os.getpid()
+
+
+def _worker_predict_slot(path, stamp, name, rows, width, n_classes):
+    compiled = _use_model(path, stamp).compiled
+    buffer = _attach(name).buf
+    out_offset, _ = _layout(rows, width, n_classes)
+    X = np.ndarray((rows, width), dtype=np.float32, buffer=buffer)
+    out = np.ndarray((rows, n_classes), dtype=np.float64, buffer=buffer, offset=out_offset)
+    out[:] = compiled.predict_proba(X)
+
+
+def _worker_predict_frame(path, stamp, features):
+    return _use_model(path, stamp).model.predict_proba(features)
+
+
+class InferencePool:
+    """Score feature rows in a pool of worker processes, each with the model loaded once.
+
+    A single process runs the forest under the GIL, so scoring threads queue up
+    behind one another however many cores the host has. This pool hands the
+    work to ``processes`` worker processes instead. Each one loads the model
+    through its own ``ModelRegistry`` (the memory-mapped joblib file, so the
+    arrays are shared through the page cache) and reloads it when the parent
+    passes a newer model version.
+
+    For compiled models the parent one-hot encodes the rows and copies the
+    float32 matrix into a shared-memory slot. The worker writes the
+    probabilities back into the same slot, so only the slot name and the shape
+    travel through the pipe. Batches larger than ``slot_rows`` are split into
+    chunks that run on several workers at once. Pipelines that don't compile
+    are pickled to the workers as feature frames.
+
+    There are ``slots`` slots (two per process by default). A caller that
+    can't get a slot within ``acquire_timeout`` seconds gets ``PoolSaturated``,
+    which the app turns into a 503, instead of waiting in an ever longer queue.
+    """
+
+    def __init__(self, path, processes=None, slot_rows=4096, slots=None, acquire_timeout=1.0, mmap=True):
+        self.path = path
+        self.processes = processes or os.cpu_count() or 1
+        self.slot_rows = slot_rows
+        self.slots = slots or 2 * self.processes
+        self.acquire_timeout = acquire_timeout
+        self.mmap = mmap
+        self._executor = None
+        self._free = queue.LifoQueue()
+        self._all = []
+        self._lock = threading.Lock()
+        self.saturated = 0
+        self.chunks = 0
+
+    def start(self):
+        """Start the workers and wait until every one of them has loaded the model."""
+        # spawn rather than fork: the parent has threads (the model watcher, the journal flusher)
+        context = multiprocessing.get_context("spawn")
+        self._executor = ProcessPoolExecutor(self.processes, mp_context=context,
+                                             initializer=_init_worker, initargs=(self.path, self.mmap))
+        for _ in range(self.slots):
+            self._free.put(None)  # slots get their shared memory on first use, once the model width is known
+        pids = {f.result() for f in [self._executor.submit(_worker_ping) for _ in range(self.processes)]}
+        return sorted(pids)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        with self._lock:
+            for slot in self._all:
+                slot.close()
+            self._all.clear()
+
+    # slots
+
+    def _acquire(self, block):
+        """A free slot (``None`` if it has no shared memory yet), or ``False`` if none is free and not ``block``."""
+        try:
+            return self._free.get(block, self.acquire_timeout if block else None)
+        except queue.Empty:
+            if block:
+                with self._lock:
+                    self.saturated += 1
+                raise PoolSaturated(f"all {self.slots} inference slots busy") from None
+            return False
+
+    def _release(self, slot):
+        self._free.put(slot)
+
+    def _sized(self, slot, nbytes):
+        if slot is not None and slot.fits(nbytes):
+            return slot
+        replacement = _Slot(nbytes)
+        with self._lock:
+            if slot is not None:
+                self._all.remove(slot)
+                slot.close()
+            self._all.append(replacement)
+        return replacement
+
+    # scoring
+
+    def predict_proba(self, mv, X=None, features=None):
+        """Probabilities for an encoded matrix ``X`` (compiled models) or a feature frame."""
+        if mv.compiled is None:
+            slot = self._acquire(block=True)
+            try:
+                return self._executor.submit(_worker_predict_frame, mv.path, mv.stamp, features).result()
+            finally:
+                self._release(slot)
+
+        n, width = X.shape
+        n_classes = len(mv.compiled.classes_)
+        out = np.empty((n, n_classes))
+        inflight = deque()
+
+        def finish():
+            slot, future, start, rows = inflight.popleft()
+            try:
+                future.result()
+                out_offset, _ = _layout(rows, width, n_classes)
+                out[start:start + rows] = np.ndarray((rows, n_classes), dtype=np.float64,
+                                                     buffer=slot.shm.buf, offset=out_offset)
+            except BaseException:
+                self._release(slot)
+                raise
+            return slot
+
+        try:
+            for start in range(0, n, self.slot_rows):
+                chunk = X[start:start + self.slot_rows]
+                rows = len(chunk)
+                # only wait on other callers while holding nothing; otherwise reuse our own oldest slot
+                slot = self._acquire(block=not inflight)
+                if slot is False:
+                    slot = finish()
+                slot = self._sized(slot, _layout(self.slot_rows, width, n_classes)[1])
+                np.ndarray((rows, width), dtype=np.float32, buffer=slot.shm.buf)[:] = chunk
+                try:
+                    future = self._executor.submit(_worker_predict_slot, mv.path, mv.stamp,
+                                                   slot.name, rows, width, n_classes)
+                except BaseException:
+                    self._release(slot)
+                    raise
+                inflight.append((slot, future, start, rows))
+                with self._lock:
+                    self.chunks += 1
+            while inflight:
+                self._release(finish())
+        finally:
+            # on error, let the chunks still running finish writing before their slots are reused
+            for slot, future, _, _ in inflight:
+                future.exception()
+                self._release(slot)
+        return out
+
+    def stats(self):
+        with self._lock:
+            return {
+                "processes": self.processes,
+                "slots": self.slots,
+                "free_slots": self._free.qsize(),
+                "slot_rows": self.slot_rows,
+                "chunks": self.chunks,
+                "saturated": self.saturated,
+            }
@@ -0,0 +1,380 @@
+import asyncio
+import contextvars
+import functools
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRoute
+
+from fast_json import FastJSONResponse
+
+# the request being handled: its phase timings and where its handler / endpoint currently are.
+# Sync endpoints run in a thread pool that copies the context, so they add to the same dict.
+_current = contextvars.ContextVar("request_timing", default=None)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+@contextmanager
+def phase(name):
+    """Add the time spent in the block to phase ``name`` of the current request (if there is one)."""
+    state = _current.get()
+    if state is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases = state["phases"]
+        phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
+
+
+class Timed:
+    """Proxy that books every method call on ``target`` (and the entry and exit of any
+    context manager it returns, like ``store.transaction()``) under one phase."""
+
+    def __init__(self, target, phase_name):
+        self._target = target
+        self._phase = phase_name
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not callable(value):
+            return value
+
+        @functools.wraps(value)
+        def call(*args, **kwargs):
+            with phase(self._phase):
+                result = value(*args, **kwargs)
+            if hasattr(result, "__enter__") and hasattr(result, "__exit__"):
+                return _TimedContext(result, self._phase)
+            return result
+        return call
+
+    def __contains__(self, key):
+        with phase(self._phase):
+            return key in self._target
+
+
+class _TimedContext:
+    def __init__(self, context, phase_name):
+        self._context = context
+        self._phase = phase_name
+
+    def __enter__(self):
+        with phase(self._phase):
+            return self._context.__enter__()
+
+    def __exit__(self, *exc):
+        with phase(self._phase):
+            return self._context.__exit__(*exc)
+
+
+class TimedJSONResponse(FastJSONResponse):
+    """FastJSONResponse whose rendering counts as serialization, also when an endpoint builds it itself."""
+
+    def render(self, content):
+        state = _current.get()
+        if state is None or "endpoint_end" in state:
+            return super().render(content)  # after the endpoint the route already times it
+        with phase("serialization"):
+            return super().render(content)
+
+
+# per-route phases: validation is everything FastAPI does before the endpoint runs (reading the body,
+# parsing and validating parameters), serialization everything after it returns
+
+def _timed_endpoint(endpoint):
+    def enter():
+        state = _current.get()
+        if state is not None and "handler_start" in state:
+            phases = state["phases"]
+            phases["validation"] = phases.get("validation", 0.0) + time.perf_counter() - state["handler_start"]
+        return state
+
+    def leave(state):
+        if state is not None:
+            state["endpoint_end"] = time.perf_counter()
+
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def timed(*args, **kwargs):
+            state = enter()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                leave(state)
+    else:
+        @functools.wraps(endpoint)
+        def timed(*args, **kwargs):
+            state = enter()
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                leave(state)
+    return timed
+
+
+class TimedRoute(APIRoute):
+    """APIRoute that splits a request's time into validation, the endpoint itself and serialization."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            state = _current.get()
+            if state is None:
+                return await handler(request)
+            state["handler_start"] = time.perf_counter()
+            response = await handler(request)
+            if "endpoint_end" in state:
+                phases = state["phases"]
+                phases["serialization"] = phases.get("serialization", 0.0) + time.perf_counter() - state["endpoint_end"]
+            return response
+        return timed_handler
+
+
+# metrics
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for upper, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{{{labels},le=\"{upper}\"}} {cumulative}")
+        lines.append(f"{name}_bucket{{{labels},le=\"+Inf\"}} {self.count}")
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Per-route request latency and phase histograms, rendered in the Prometheus text format.
+
+    Routes are labelled by their path template (``/patient/{patient_id}``), so
+    the number of series stays bounded. Each worker process keeps its own
+    numbers; Prometheus adds them up across workers.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._phases = {}
+        self._responses = Counter()
+        self.in_flight = 0
+        self.started = time.time()
+
+    def observe(self, method, route, status, seconds, phases):
+        with self._lock:
+            key = (method, route)
+            if key not in self._latency:
+                self._latency[key] = Histogram(self.buckets)
+            self._latency[key].observe(seconds)
+            self._responses[(method, route, status)] += 1
+            for name, spent in phases.items():
+                key = (method, route, name)
+                if key not in self._phases:
+                    self._phases[key] = Histogram(self.buckets)
+                self._phases[key].observe(spent)
+
+    def render(self):
+        with self._lock:
+            lines = [
+                "# HELP http_requests_total Requests handled, by route and status code.",
+                "# TYPE http_requests_total counter",
+            ]
+            for (method, route, status), count in sorted(self._responses.items()):
+                lines.append(f'http_requests_total{{method="{method}",route="{_label(route)}",status="{status}"}} {count}')
+            lines += [
+                "# HELP http_request_duration_seconds Time from receiving a request to sending the last byte.",
+                "# TYPE http_request_duration_seconds histogram",
+            ]
+            for (method, route), histogram in sorted(self._latency.items()):
+                lines += histogram.render("http_request_duration_seconds", f'method="{method}",route="{_label(route)}"')
+            lines += [
+                "# HELP http_request_phase_seconds Time spent per request in storage, validation, inference, "
+                "serialization, ...",
+                "# TYPE http_request_phase_seconds histogram",
+            ]
+            for (method, route, name), histogram in sorted(self._phases.items()):
+                lines += histogram.render("http_request_phase_seconds",
+                                          f'method="{method}",route="{_label(route)}",phase="{name}"')
+            lines += [
+                "# HELP http_requests_in_flight Requests currently being handled.",
+                "# TYPE http_requests_in_flight gauge",
+                f"http_requests_in_flight {self.in_flight}",
+                "# HELP process_start_time_seconds Start time of the process since the epoch.",
+                "# TYPE process_start_time_seconds gauge",
+                f"process_start_time_seconds {self.started}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+# profiling
+
+class SamplingProfiler:
+    """Samples the Python stacks of every thread every ``interval`` seconds while running.
+
+    The whole process is sampled, so the thread pool doing a sync endpoint's work
+    or a batch's inference shows up too; under load so does work for other
+    requests that ran at the same time.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def dump(self, path, header):
+        """Write the samples as collapsed stacks (one ``root;...;leaf count`` line per stack), the format
+        flamegraph.pl and speedscope read, after a ``#`` header line."""
+        self_time = Counter()
+        for stack, count in self.samples.items():
+            self_time[stack.rsplit(";", 1)[-1]] += count
+        with open(path, "w") as f:
+            f.write(f"# {header}, {sum(self.samples.values())} samples every {self.interval * 1000:g} ms\n")
+            for leaf, count in self_time.most_common(15):
+                f.write(f"# self {count:>6}  {leaf}\n")
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class InstrumentationMiddleware:
+    """ASGI middleware recording every request's latency, status and phase times into ``metrics``.
+
+    With ``profiling`` on, a request carrying ``X-Profile: 1`` runs under a
+    ``SamplingProfiler``, and so does a random ``profile_sample_rate`` fraction
+    of all requests. The dump goes to ``profile_dir`` and the response
+    names the file in an ``X-Profile`` header.
+    """
+
+    def __init__(self, app, metrics, profiling=False, profile_sample_rate=0.0, profile_dir=None,
+                 profile_interval=0.005):
+        self.app = app
+        self.metrics = metrics
+        self.profiling = profiling
+        self.profile_sample_rate = profile_sample_rate
+        self.profile_dir = profile_dir or os.path.join(tempfile.gettempdir(), "fastapi-profiles")
+        self.profile_interval = profile_interval
+
+    def _wants_profile(self, scope):
+        if self.profiling and (b"x-profile", b"1") in scope.get("headers", []):
+            return True
+        return self.profile_sample_rate > 0 and random.random() < self.profile_sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        state = {"phases": {}}
+        token = _current.set(state)
+        status = 500
+        profiler = profile_path = None
+        if self._wants_profile(scope):
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profile_path = os.path.join(self.profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.txt")
+            profiler = SamplingProfiler(self.profile_interval).start()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if profile_path is not None:
+                    message = dict(message, headers=list(message.get("headers", [])) +
+                                   [(b"x-profile", profile_path.encode())])
+            await send(message)
+
+        self.metrics.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.metrics.in_flight -= 1
+            _current.reset(token)
+            route = scope.get("route")
+            route = route.path if route is not None else "<unmatched>"
+            self.metrics.observe(scope["method"], route, status, elapsed, state["phases"])
+            if profiler is not None:
+                profiler.stop()
+                profiler.dump(profile_path, f"{scope['method']} {scope['path']} -> {status} in {elapsed * 1000:.1f} ms")
+
+
+def instrument(app):
+    """Time every route of ``app`` by phase and serve the numbers on ``GET /metrics``.
+
+    Call it right after creating the app, before any route is declared.
+    ``PROFILING=1`` enables the ``X-Profile: 1`` request header,
+    ``PROFILE_SAMPLE_RATE`` profiles that fraction of all requests, and dumps
+    go to ``PROFILE_DIR``.
+    """
+    metrics = Metrics()
+    app.router.route_class = TimedRoute
+    app.add_middleware(
+        InstrumentationMiddleware, metrics=metrics,
+        profiling=os.environ.get("PROFILING", "0") == "1",
+        profile_sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", 0)),
+        profile_dir=os.environ.get("PROFILE_DIR"),
+        profile_interval=float(os.environ.get("PROFILE_INTERVAL_MS", 5)) / 1000,
+    )
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics_endpoint():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    return metrics
@@ -0,0 +1,169 @@
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from file_stamp import file_stamp
+
+
+def normalize_city(name):
+    """Lookup key for a city name: case-folded, with runs of whitespace collapsed to one space."""
+    return " ".join(str(name).casefold().split())
+
+
+class CityTiers:
+    """The city -> tier table from ``city_tiers.json``, compiled into one dict.
+
+    The file lists the cities of each tier plus aliases (``"Bengaluru": "Bangalore"``).
+    Names and aliases are stored under ``normalize_city`` keys, so lookups ignore
+    case and extra whitespace and stay a single dict probe however many locations
+    the file holds. Anything not in the table gets ``default_tier``.
+
+    The file is checked for changes at most every ``check_interval`` seconds during
+    lookups and reloaded then, or right away with ``reload()``. A file that doesn't
+    load keeps the previous table in place and its error in ``error``.
+    """
+
+    def __init__(self, path, check_interval=5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.error = None
+        self._stamp = None
+        self._checked = time.monotonic()
+        self.reload()
+
+    @staticmethod
+    def compile(data):
+        """``(lookup, default_tier, {tier: [city names as listed]})`` from the file's contents."""
+        lookup, names = {}, {}
+        for tier, cities in data["tiers"].items():
+            tier = int(tier)
+            names[tier] = list(cities)
+            for city in cities:
+                key = normalize_city(city)
+                if lookup.setdefault(key, tier) != tier:
+                    raise ValueError(f"{city!r} is listed in tier {lookup[key]} and tier {tier}")
+        for alias, city in data.get("aliases", {}).items():
+            if normalize_city(city) not in lookup:
+                raise ValueError(f"alias {alias!r} points to {city!r}, which is in no tier")
+            lookup[normalize_city(alias)] = lookup[normalize_city(city)]
+        return lookup, int(data.get("default_tier", 3)), names
+
+    def reload(self):
+        stamp = file_stamp(self.path)
+        try:
+            with open(self.path) as f:
+                table = self.compile(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.error = f"{type(e).__name__}: {e}"
+            if not hasattr(self, "_table"):
+                raise
+            return False
+        self._table = table  # swapped in one assignment, so lookups never see half a table
+        self._stamp = stamp
+        self.error = None
+        self.loaded_at = time.time()
+        return True
+
+    def _check(self):
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        if file_stamp(self.path) != self._stamp:
+            self.reload()
+
+    def tier(self, city):
+        self._check()
+        lookup, default, _ = self._table
+        return lookup.get(normalize_city(city), default)
+
+    def tier_array(self, cities):
+        """Tiers for a column of city names; each distinct name is looked up once."""
+        self._check()
+        lookup, default, _ = self._table
+        codes, uniques = pd.factorize(pd.Series(cities), use_na_sentinel=False)
+        return np.array([lookup.get(normalize_city(city), default) for city in uniques], dtype=int)[codes]
+
+    def cities(self, tier):
+        """The city names listed under ``tier`` (without aliases)."""
+        return list(self._table[2].get(tier, []))
+
+    def info(self):
+        lookup, default, _ = self._table
+        return {"path": self.path, "entries": len(lookup), "default_tier": default,
+                "loaded_at": self.loaded_at, "error": self.error}
+
+
+city_tiers = CityTiers(os.environ.get("CITY_TIERS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                      "city_tiers.json")),
+                       check_interval=float(os.environ.get("CITY_TIERS_CHECK_INTERVAL", 5)))
+
+# age_group: [0, 25) young, [25, 45) adult, [45, 60) middle_aged, 60+ senior
+AGE_BINS = [-np.inf, 25, 45, 60, np.inf]
+AGE_GROUPS = ["young", "adult", "middle_aged", "senior"]
+
+# lifestyle_risk: a smoker above HIGH_RISK_BMI is high, a smoker or anyone above MEDIUM_RISK_BMI is medium
+HIGH_RISK_BMI = 30
+MEDIUM_RISK_BMI = 27
+
+# raw user fields, and the engineered columns the model was trained on (in training order)
+INPUT_COLUMNS = ["age", "weight", "height", "income_lpa", "smoker", "city", "occupation"]
+FEATURE_COLUMNS = ["bmi", "age_group", "lifestyle_risk", "city_tier", "income_lpa", "occupation"]
+CATEGORICAL_FEATURES = ["age_group", "lifestyle_risk", "occupation", "city_tier"]
+NUMERIC_FEATURES = ["bmi", "income_lpa"]
+TARGET_COLUMN = "insurance_premium_category"
+
+
+# one user at a time (the UserInput computed fields)
+
+def bmi(weight, height):
+    return weight / height ** 2
+
+
+def age_group(age):
+    for upper, group in zip(AGE_BINS[1:], AGE_GROUPS):
+        if age < upper:
+            return group
+    return AGE_GROUPS[-1]
+
+
+def lifestyle_risk(smoker, bmi):
+    if smoker and bmi > HIGH_RISK_BMI:
+        return "high"
+    elif smoker or bmi > MEDIUM_RISK_BMI:
+        return "medium"
+    return "low"
+
+
+def city_tier(city):
+    return city_tiers.tier(city)
+
+
+# whole columns at once (batch scoring and training)
+
+def engineer_features(df):
+    """Compute the model's feature frame from raw user columns, column-wise.
+
+    The same rules as the scalar functions above (which ``UserInput`` uses), with
+    ``pd.cut``, ``np.select`` and one tier lookup per distinct city over whole columns instead of one
+    Python call per row. ``train_model.py`` builds its training frame with this too.
+    """
+    smoker = df["smoker"].to_numpy(dtype=bool)
+    bmi = df["weight"].to_numpy(dtype=float) / df["height"].to_numpy(dtype=float) ** 2
+
+    age_group = pd.cut(df["age"].to_numpy(dtype=float), AGE_BINS, right=False, labels=AGE_GROUPS)
+    lifestyle_risk = np.select([smoker & (bmi > HIGH_RISK_BMI), smoker | (bmi > MEDIUM_RISK_BMI)],
+                               ["high", "medium"], default="low")
+    city_tier = city_tiers.tier_array(df["city"])
+
+    return pd.DataFrame({
+        "bmi": bmi,
+        "age_group": np.asarray(age_group, dtype=object),
+        "lifestyle_risk": lifestyle_risk,
+        "city_tier": city_tier,
+        "income_lpa": df["income_lpa"].to_numpy(dtype=float),
+        "occupation": df["occupation"].to_numpy(),
+    }, index=df.index)
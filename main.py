@@ -1,10 +1,35 @@
-from fastapi import FastAPI, Path, HTTPException, Query
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field, computed_field
+from fastapi import FastAPI, Path, HTTPException, Query, Header, Request, Response
+from pydantic import BaseModel, Field, TypeAdapter, computed_field
 from typing import Annotated, Literal, Optional
+from contextlib import asynccontextmanager
+import hashlib
 import json
+import os
+import time
+from instrumentation import instrument, phase, Timed, TimedJSONResponse as JSONResponse
+from patient_backend import open_store
+from patient_index import sort_key
+from pagination import decode_cursor, parse_fields, project, page_response, iter_records, ndjson_response
+from patient_bulk import BULK_CHUNK, read_lines, ndjson_rows, csv_rows, validate_chunk, ingest, csv_response
+from response_cache import ResponseCache
 
-app = FastAPI()
+# storage backend picked by PATIENT_STORE: "json" (patients.json + journal, served from memory) or "sqlite";
+# every call on it is timed as the "storage" phase of the request in /metrics
+store = Timed(open_store(), "storage")
+
+# rendered /view, /sort and /patient bodies, reused until the data they came from changes
+response_cache = ResponseCache(maxsize=int(os.environ.get("RESPONSE_CACHE_SIZE", "256")),
+                               max_bytes=int(os.environ.get("RESPONSE_CACHE_BYTES", str(64 * 1024 * 1024))))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    store.close()  # fsync whatever is still pending / close pooled connections
+
+app = FastAPI(lifespan=lifespan, default_response_class=JSONResponse)
+instrument(app)  # per-route latency and phase timings on /metrics, opt-in profiling (see instrumentation.py)
+
+Verdict = Literal["Underweight", "Normal weight", "Overweight", "Obesity"]
 
 class Patient(BaseModel):
 
@@ -24,7 +49,7 @@ class Patient(BaseModel):
     
     @computed_field
     @property
-    def verdict(self) -> str:
+    def verdict(self) -> Verdict:
         if self.bmi < 18.5:
             return "Underweight"
         elif 18.5 <= self.bmi < 24.9:
@@ -34,6 +59,9 @@ class Patient(BaseModel):
         else:
             return "Obesity"
 
+# validates a whole chunk of bulk-imported rows in one call into pydantic-core
+patient_list = TypeAdapter(list[Patient])
+
 class PatientUpdate(BaseModel):
     name: Annotated[Optional[str], Field( default=None)]
     city: Annotated[Optional[str], Field( default=None)]
@@ -42,13 +70,45 @@ class PatientUpdate(BaseModel):
     height: Annotated[Optional[float], Field( gt=0, default=None)]
     weight: Annotated[Optional[float], Field( gt=0, default=None)]
 
-def load_data():
-    with open("patients.json") as f:
-        return json.load(f)
+def etag(version):
+    return f'"{version}"'
+
+def record_etag(record):
+    # versions come from one store-wide counter and never repeat; records from a patients.json
+    # written before versions existed have none, so theirs is a hash of the content instead
+    if "version" in record:
+        return etag(record["version"])
+    digest = hashlib.blake2b(json.dumps(record, sort_keys=True).encode(), digest_size=8).hexdigest()
+    return etag(f"h-{digest}")
+
+def if_match_ok(if_match, record):
+    # "*" matches any existing record, otherwise one of the listed ETags must be the current one
+    if if_match is None or if_match.strip() == "*":
+        return True
+    return record_etag(record) in [tag.strip() for tag in if_match.split(",")]
+
+def not_modified(if_none_match, tag):
+    # If-None-Match compares weakly, so a W/ prefix added by a proxy still matches
+    if if_none_match is None:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or tag in tags
 
-def save_data(data):
-    with open("patients.json", "w") as f:
-        json.dump(data, f, default=str)
+def conditional_response(key, revision, tag, if_none_match, build):
+    """304 when the client already has ``tag``, else the body cached for ``key`` at ``revision``, else ``build()`` rendered and cached."""
+    headers = {"ETag": tag}
+    if not_modified(if_none_match, tag):
+        return Response(status_code=304, headers=headers)
+    body = response_cache.get(key, revision)
+    if body is None:
+        body = JSONResponse(build()).body
+        response_cache.put(key, revision, body)
+    return Response(body, media_type="application/json", headers=headers)
+
+def forget(patient_ids):
+    # whole-store responses include every patient, single-patient ones only their own
+    patient_ids = set(patient_ids)
+    response_cache.discard(lambda key: key[0] != "patient" or key[1] in patient_ids)
 
 @app.get("/")
 def hello():
@@ -59,85 +119,207 @@ def about():
     return {"message": "A fully functional API for managing patient data."}
     
 @app.get("/view")
-def view():
-    data = load_data()
-    return data
+def view(limit: Optional[int] = Query(None, gt=0, le=10000, description="Return at most this many patients, ordered by ID"),
+         cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+         fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. name,city"),
+         format: Literal["json", "ndjson"] = Query("json", description="ndjson streams one patient per line"),
+         if_none_match: Optional[str] = Header(None, description="ETag of an earlier response; 304 if nothing changed since")):
+    selected = parse_fields(fields)
+    after = decode_cursor(cursor)
+    # read before the data, so a response can only be labelled older than it is, never newer
+    revision = store.revision()
+    tag = etag(f"rev-{revision}")
+    if format == "ndjson":
+        if not_modified(if_none_match, tag):
+            return Response(status_code=304, headers={"ETag": tag})
+        response = ndjson_response(iter_records(store.page, lambda patient_id, record: patient_id, after, limit), selected)
+        response.headers["ETag"] = tag
+        return response
+
+    # rendered straight from the records, without a jsonable_encoder pass
+    def build():
+        if limit is not None or cursor is not None:
+            return page_response(store.page(after, limit), selected, limit, lambda patient_id, record: patient_id)
+        return {patient_id: project(record, selected) for patient_id, record in store.all().items()}
+
+    return conditional_response(("view", limit, cursor, fields), revision, tag, if_none_match, build)
 
 @app.get("/patient/{patient_id}")
-def view_patient(patient_id: str = Path(..., description="Sort on the basis of height, weight or bmi")):
-    data = load_data()
-    # import pdb; pdb.set_trace()  # Debugging line to inspect the patient_id
-    print(patient_id)
-    if patient_id in data:
-        return data[patient_id]
+def view_patient(patient_id: str = Path(..., description="Sort on the basis of height, weight or bmi"),
+                 if_none_match: Optional[str] = Header(None, description="ETag of an earlier response; 304 if the patient hasn't changed")):
+    patient = store.get(patient_id)
+    if patient is not None:
+        # the cached body is checked against the record itself, so it stays right across workers
+        return conditional_response(("patient", patient_id), patient, record_etag(patient), if_none_match, lambda: patient)
     raise HTTPException(status_code=404, detail="Patient not found")
 
 @app.get("/sort")
-def sort_patients(sort_by: str = Query(..., description="Sort on the basis of height, weight or bmi"), order: str = Query("asc", description="sort in asc or desc order")):
+def sort_patients(sort_by: str = Query(..., description="Sort on the basis of height, weight or bmi"), order: str = Query("asc", description="sort in asc or desc order"),
+                  limit: Optional[int] = Query(None, gt=0, le=10000, description="Return at most this many patients"),
+                  cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+                  fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. name,bmi"),
+                  format: Literal["json", "ndjson"] = Query("json", description="ndjson streams one patient per line"),
+                  if_none_match: Optional[str] = Header(None, description="ETag of an earlier response; 304 if nothing changed since")):
     valid_fields = ["height", "weight", "bmi"]
     if sort_by not in valid_fields:
         raise HTTPException(status_code=400, detail=f"Invalid sort field, select from {valid_fields}")
     if order not in ["asc", "desc"]:
         raise HTTPException(status_code=400, detail="Invalid order, use 'asc' or 'desc'")
     
-    data = load_data()
     sort_order = True if order == "desc" else False
-    
-    sorted_data = dict(sorted(data.items(), key=lambda item: item[1].get(sort_by, ""), reverse=sort_order))
-    return sorted_data
+    selected = parse_fields(fields)
+    after = decode_cursor(cursor, sort=True)
 
-@app.post("/create")
-def create_patient(patient: Patient):
-    # load the data
-    data = load_data()
+    # walk the backend's index a page at a time; the cursor is the (value, id) of the last patient sent
+    def fetch(after, n):
+        return store.sorted_by(sort_by, descending=sort_order, limit=n, after=after)
 
-    # check if the patient already exists
-    if patient.id in data:
-        raise HTTPException(status_code=400, detail="Patient already exists")
-    # add new patient to the data but patient is pydantic object and needs to be converted to dict
-    data[patient.id] = patient.model_dump(exclude=["id"])  # this will also include computed fields
+    def next_after(patient_id, record):
+        return (sort_key(record.get(sort_by)), patient_id)
 
-    # save the data
-    save_data(data)
+    revision = store.revision()
+    tag = etag(f"rev-{revision}")
+    if format == "ndjson":
+        if not_modified(if_none_match, tag):
+            return Response(status_code=304, headers={"ETag": tag})
+        response = ndjson_response(iter_records(fetch, next_after, after, limit), selected)
+        response.headers["ETag"] = tag
+        return response
 
-    return JSONResponse(status_code=201, content={"message": "Patient created successfully"})
+    def build():
+        if limit is not None or cursor is not None:
+            return page_response(fetch(after, limit), selected, limit, next_after)
+        return {patient_id: project(record, selected) for patient_id, record in fetch(None, None)}
 
-@app.put('/edit/{patient_id}')
-def update_patient(patient_id: str, patient_update: PatientUpdate):
+    return conditional_response(("sort", sort_by, order, limit, cursor, fields), revision, tag, if_none_match, build)
 
-    data = load_data()
-    if patient_id not in data:
-        raise HTTPException(status_code=404, detail="Patient not found")
+@app.get("/patients/search")
+def search_patients(city: Optional[str] = Query(None, description="Exact city name, e.g. Mumbai"),
+                    gender: Optional[Literal['male', 'female', 'other']] = Query(None),
+                    verdict: Optional[Verdict] = Query(None, description="BMI verdict, e.g. Obesity"),
+                    age_min: Optional[int] = Query(None, ge=0), age_max: Optional[int] = Query(None, ge=0),
+                    bmi_min: Optional[float] = Query(None, ge=0), bmi_max: Optional[float] = Query(None, ge=0),
+                    limit: int = Query(100, gt=0, le=10000, description="Return at most this many patients, ordered by ID"),
+                    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+                    fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. name,city")):
+    filters = {field: value for field, value in (("city", city), ("gender", gender), ("verdict", verdict)) if value is not None}
+    if age_min is not None or age_max is not None:
+        filters["age"] = (age_min, age_max)
+    if bmi_min is not None or bmi_max is not None:
+        filters["bmi"] = (bmi_min, bmi_max)
 
-    # Update patient data
-    existing_patient_info = data[patient_id]                               # fetch the existing patient info
-    updated_patient_info = patient_update.model_dump(exclude_unset=True)   # fetch the updated patient info with only updated field using exclude_unset =True
+    # matches come from the backend's inverted/sorted indexes, facet counts from its precomputed tables
+    result = store.search(filters, limit=limit, after=decode_cursor(cursor))
+    response = page_response(result["items"], parse_fields(fields), limit, lambda patient_id, record: patient_id)
+    return JSONResponse({"total": result["total"], "facets": result["facets"], **response})
 
-    for key, value in updated_patient_info.items():                        # Now, we have update the existing patient info with the new values
-        existing_patient_info[key] = value
+@app.get("/stats")
+def patient_stats(percentiles: str = Query("50,90,99", description="Comma separated BMI percentiles, e.g. 50,95,99"),
+                  age_bin: int = Query(10, gt=0, le=120, description="Width of the age histogram bins in years")):
+    try:
+        selected = [float(value) for value in percentiles.split(",") if value.strip()]
+    except ValueError:
+        selected = []
+    if not selected or not all(0 <= value <= 100 for value in selected):
+        raise HTTPException(status_code=400, detail="Invalid percentiles, use numbers between 0 and 100, e.g. 50,90,99")
 
-    # Now, Since we do have updated value of BMI and verdict so, we have to convert the updated existing_patient_info into patient pytantic model
-    existing_patient_info['id'] = patient_id
-    existing_patient_info = Patient(**existing_patient_info) # while converting, it required "id" field as well, so we have add it
+    # vectorized over NumPy columns; with PATIENT_COLUMNAR=1 the JSON backend keeps them up to date on every write
+    start = time.perf_counter()
+    stats = store.stats(selected, age_bin)
+    return JSONResponse({**stats, "compute_ms": round((time.perf_counter() - start) * 1e3, 2)})
 
-    # convert from pydantic model to dict
-    existing_patient_info = existing_patient_info.model_dump(exclude=["id"])  # here, again we need to remove the "id" column, before adding into dictionary (since it is not present in values)
+@app.get("/cache/stats")
+def cache_stats():
+    return response_cache.stats()
 
-    # add this dict to our data
-    data[patient_id] = existing_patient_info
+@app.post("/create")
+def create_patient(patient: Patient):
+    # the check and the write happen under one lock, so two concurrent creates can't both succeed
+    with store.transaction():
+        # check if the patient already exists
+        if patient.id in store:
+            raise HTTPException(status_code=400, detail="Patient already exists")
+        # add new patient to the store but patient is pydantic object and needs to be converted to dict
+        version = store.put(patient.id, patient.model_dump(exclude=["id"]))  # this will also include computed fields, and saves the file
+    forget([patient.id])
+
+    return JSONResponse(status_code=201, content={"message": "Patient created successfully"}, headers={"ETag": etag(version)})
+
+@app.put('/edit/{patient_id}')
+def update_patient(patient_id: str, patient_update: PatientUpdate, if_match: Optional[str] = Header(None, description="ETag from GET /patient/{patient_id}; the edit is rejected if the patient changed since")):
+
+    # read -> modify -> write happens under one lock, so concurrent edits are never lost
+    with store.transaction():
+        if patient_id not in store:
+            raise HTTPException(status_code=404, detail="Patient not found")
+
+        # Update patient data
+        existing_patient_info = dict(store.get(patient_id))                    # fetch a copy of the existing patient info, so a failed validation leaves the store untouched
+        if not if_match_ok(if_match, existing_patient_info):
+            raise HTTPException(status_code=412, detail="Patient was modified by another request")
+        updated_patient_info = patient_update.model_dump(exclude_unset=True)   # fetch the updated patient info with only updated field using exclude_unset =True
 
-    # save data
-    save_data(data)
+        for key, value in updated_patient_info.items():                        # Now, we have update the existing patient info with the new values
+            existing_patient_info[key] = value
 
-    return JSONResponse(status_code=200, content={"message": "Patient updated successfully"})
+        # Now, Since we do have updated value of BMI and verdict so, we have to convert the updated existing_patient_info into patient pytantic model
+        existing_patient_info['id'] = patient_id
+        existing_patient_info = Patient(**existing_patient_info) # while converting, it required "id" field as well, so we have add it
+
+        # convert from pydantic model to dict
+        existing_patient_info = existing_patient_info.model_dump(exclude=["id"])  # here, again we need to remove the "id" column, before adding into dictionary (since it is not present in values)
+
+        # add this dict to the store (this also saves it to disk)
+        version = store.put(patient_id, existing_patient_info)
+    forget([patient_id])
+
+    return JSONResponse(status_code=200, content={"message": "Patient updated successfully"}, headers={"ETag": etag(version)})
 
 @app.delete('/delete/{patient_id}')
 def delete_patient(patient_id: str):
-    data = load_data()
-    if patient_id not in data:
-        raise HTTPException(status_code=404, detail="Patient not found")
+    with store.transaction():
+        if patient_id not in store:
+            raise HTTPException(status_code=404, detail="Patient not found")
+
+        store.delete(patient_id)
+    forget([patient_id])
+
+    return JSONResponse(status_code=200, content={"message": "Patient deleted successfully"})
+
+@app.post("/patients/bulk")
+async def bulk_import(request: Request,
+                      format: Optional[Literal["ndjson", "csv"]] = Query(None, description="Body format; by default taken from Content-Type (text/csv, otherwise NDJSON)"),
+                      upsert: bool = Query(False, description="Replace patients that already exist instead of rejecting them"),
+                      chunk: int = Query(BULK_CHUNK, gt=0, le=10000, description="Rows validated and committed together")):
+    if format is None:
+        format = "csv" if request.headers.get("content-type", "").startswith("text/csv") else "ndjson"
+    rows = (csv_rows if format == "csv" else ndjson_rows)(read_lines(request.stream()))
+
+    # one TypeAdapter call validates the chunk and one store write commits it; bad rows are
+    # reported by line number and skipped, the rest of the chunk still goes in
+    def commit(batch):
+        with phase("validation"):
+            valid, errors = validate_chunk(patient_list, batch)
+        with store.transaction():
+            accepted, seen = [], set()
+            for number, patient in valid:
+                if not upsert and (patient.id in seen or patient.id in store):
+                    errors.append((number, f"Patient {patient.id} already exists"))
+                    continue
+                seen.add(patient.id)
+                accepted.append((patient.id, patient.model_dump(exclude=["id"])))
+            store.put_many(accepted)
+        forget(patient_id for patient_id, _ in accepted)
+        return len(accepted), errors
 
-    del data[patient_id]
-    save_data(data)
+    return await ingest(rows, commit, chunk)
 
-    return JSONResponse(status_code=200, content={"message": "Patient deleted successfully"})
\ No newline at end of file
+@app.get("/patients/bulk")
+def bulk_export(format: Literal["ndjson", "csv"] = Query("ndjson", description="ndjson or csv, both accepted back by POST /patients/bulk"),
+                fields: Optional[str] = Query(None, description="Comma separated fields to export, e.g. name,city")):
+    # streamed in ID order a page at a time, so memory stays flat however many patients there are
+    records = iter_records(store.page, lambda patient_id, record: patient_id)
+    selected = parse_fields(fields)
+    if format == "csv":
+        return csv_response(records, selected)
+    return ndjson_response(records, selected)
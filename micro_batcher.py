@@ -0,0 +1,115 @@
+import asyncio
+import threading
+
+
+class MicroBatcher:
+    """Merge concurrent single-item calls into one call of ``fn`` on a list.
+
+    ``submit(item)`` queues the item and waits for its result. A worker task takes the
+    first queued item, keeps collecting for up to ``max_wait`` seconds or until
+    ``max_batch_size`` items are in, then runs ``fn(items)`` in ``executor`` (the default
+    thread pool if ``None``) so the event loop stays free, and hands ``fn``'s results
+    back to the callers in order. While a batch runs, new items queue up for the next one.
+
+    Up to ``max_concurrent`` batches run at the same time (one by default; more
+    only helps when ``fn`` hands the work to something outside the GIL, like a
+    process pool). With ``max_queue`` set, ``submit`` raises ``asyncio.QueueFull``
+    once that many items are waiting, so callers can shed load instead of queueing.
+    """
+
+    def __init__(self, fn, max_batch_size=64, max_wait=0.005, executor=None, max_concurrent=1, max_queue=0):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.executor = executor
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self._loop = None
+        self._queue = None
+        self._worker = None
+        self._running = set()
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._batches = 0
+        self._largest = 0
+        self._last = 0
+        self._histogram = {}
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            # first call, or the app got a new event loop (e.g. a test client per test)
+            self._loop = loop
+            self._queue = asyncio.Queue(self.max_queue)
+            self._worker = loop.create_task(self._run())
+        future = loop.create_future()
+        self._queue.put_nowait((item, future))  # asyncio.QueueFull when max_queue items are waiting
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        free = asyncio.Semaphore(self.max_concurrent)
+        while True:
+            await free.acquire()  # while every runner is busy, items pile up into a bigger next batch
+            batch = await self._collect()
+            self._record(len(batch))
+            task = loop.create_task(self._score(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+            task.add_done_callback(lambda _: free.release())
+
+    async def _score(self, batch):
+        loop = asyncio.get_running_loop()
+        items = [item for item, _ in batch]
+        try:
+            results = await loop.run_in_executor(self.executor, self.fn, items)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():  # the caller may have gone away
+                future.set_result(result)
+
+    def _record(self, size):
+        bucket = 1 << (size - 1).bit_length()  # 1, 2, 4, 8, ...
+        with self._stats_lock:
+            self._requests += size
+            self._batches += 1
+            self._largest = max(self._largest, size)
+            self._last = size
+            self._histogram[bucket] = self._histogram.get(bucket, 0) + 1
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+                "requests": self._requests,
+                "batches": self._batches,
+                "mean_batch_size": self._requests / self._batches if self._batches else 0.0,
+                "max_batch_size": self._largest,
+                "last_batch_size": self._last,
+                # batches per size bucket; a key of 8 counts batches of 5 to 8 items
+                "batch_size_histogram": {str(k): v for k, v in sorted(self._histogram.items())},
+                "running_batches": len(self._running),
+                "config": {"max_batch_size": self.max_batch_size, "max_wait_ms": self.max_wait * 1000,
+                           "max_concurrent": self.max_concurrent, "max_queue": self.max_queue},
+            }
@@ -0,0 +1,161 @@
+import json
+import os
+import pickle
+import threading
+import time
+
+import joblib
+
+from compiled_model import compile_model
+from file_stamp import file_stamp
+
+
+class ModelVersion:
+    """One loaded model: the pipeline, its compiled form and where it came from."""
+
+    def __init__(self, version, model, compiled, path, stamp, load_seconds, source):
+        self.version = version
+        self.model = model
+        self.compiled = compiled
+        self.path = path
+        self.stamp = stamp
+        self.load_seconds = load_seconds
+        self.source = source
+        self.loaded_at = time.time()
+
+    def info(self):
+        return {
+            "version": self.version,
+            "path": self.path,
+            "source": self.source,
+            "compiled": self.compiled is not None,
+            "classes": [str(c) for c in getattr(self.model, "classes_", [])],
+            "load_seconds": round(self.load_seconds, 4),
+            "loaded_at": self.loaded_at,
+        }
+
+
+class ModelRegistry:
+    """Holds the model currently being served and swaps in new ones.
+
+    Pickled models are converted once to a joblib file next to them
+    (``model.pkl`` -> ``model.joblib``) and loaded with ``mmap_mode="r"``, so the
+    NumPy arrays inside are mapped from the page cache and shared by every worker
+    process instead of being copied into each. The pickle's stamp (inode, mtime,
+    size) is kept in ``model.joblib.stamp`` and the conversion is redone whenever it
+    doesn't match, even if the new pickle is older (``cp -p``, ``rsync -t``, a
+    release unpacked from a tarball). Where those files can't be written (a
+    read-only image or volume) the pickle is served as it is.
+
+    ``current`` is replaced in a single assignment. A request that picked up a
+    version keeps using it to the end, so a reload never drops in-flight work.
+    """
+
+    def __init__(self, path, mmap=True, compile=True):
+        self.path = path
+        self.mmap = mmap
+        self.compile = compile
+        self.current = None
+        self.error = None
+        self._lock = threading.Lock()
+        self._versions = 0
+        self._watcher = None
+        self._stop = threading.Event()
+
+    @property
+    def ready(self):
+        return self.current is not None
+
+    def _joblib_path(self, path):
+        return os.path.splitext(path)[0] + ".joblib"
+
+    def _read(self, path):
+        if path.endswith(".joblib"):
+            return joblib.load(path, mmap_mode="r" if self.mmap else None), "joblib"
+        if not self.mmap:
+            with open(path, "rb") as f:
+                return pickle.load(f), "pickle"
+        cached = self._joblib_path(path)
+        stamp = file_stamp(path)  # taken before reading, so a change during the read shows next time
+        if stamp is None:
+            raise FileNotFoundError(f"No model file at {path}")
+        stamp = list(stamp)
+        if file_stamp(cached) is None or self._converted_from(cached) != stamp:
+            with open(path, "rb") as f:
+                model = pickle.load(f)
+            tmp = f"{cached}.{os.getpid()}.tmp"
+            try:
+                joblib.dump(model, tmp)
+                os.replace(tmp, cached)
+                # written last: a conversion cut short leaves no matching stamp and is redone
+                with open(tmp, "w") as f:
+                    json.dump(stamp, f)
+                os.replace(tmp, f"{cached}.stamp")
+            except OSError:
+                # read-only directory or volume: serve the unpickled model, just without sharing its arrays
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                return model, "pickle (joblib conversion failed)"
+        return joblib.load(cached, mmap_mode="r"), "joblib (mmap)"
+
+    @staticmethod
+    def _converted_from(cached):
+        # stamp of the pickle ``cached`` was converted from, or None
+        try:
+            with open(f"{cached}.stamp") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(self, path=None):
+        """Load ``path`` (default: the registry's path) and make it the current model."""
+        path = path or self.path
+        with self._lock:
+            start = time.perf_counter()
+            stamp = file_stamp(path)
+            try:
+                model, source = self._read(path)
+                compiled = compile_model(model) if self.compile else None
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+                raise
+            self._versions += 1
+            self.path = path
+            self.current = ModelVersion(self._versions, model, compiled, path, stamp,
+                                        time.perf_counter() - start, source)
+            self.error = None
+            return self.current
+
+    def load_in_background(self):
+        thread = threading.Thread(target=self._load_quietly, daemon=True)
+        thread.start()
+        return thread
+
+    def _load_quietly(self):
+        try:
+            self.load()
+        except Exception:
+            pass  # kept in self.error and reported by the readiness endpoint
+
+    def reload_if_changed(self):
+        current = self.current
+        if current is not None and file_stamp(self.path) == current.stamp:
+            return False
+        self.load()
+        return True
+
+    def watch(self, interval):
+        """Poll the model file every ``interval`` seconds and hot-swap it when it changes."""
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.reload_if_changed()
+                except Exception:
+                    pass  # keep serving the previous version; the error is in self.error
+        self._watcher = threading.Thread(target=loop, daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
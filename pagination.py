@@ -0,0 +1,94 @@
+import base64
+import json
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+import fast_json
+
+PATIENT_FIELDS = ["name", "city", "age", "gender", "height", "weight", "bmi", "verdict", "version"]
+STREAM_CHUNK = 1000
+
+
+def encode_cursor(after):
+    # opaque to clients: the position of the last record they received
+    return base64.urlsafe_b64encode(json.dumps(after).encode()).decode()
+
+
+def _is_sort_value(value):
+    return value is None or (isinstance(value, (int, float)) and not isinstance(value, bool))
+
+
+def decode_cursor(cursor, sort=False):
+    """The position encoded in ``cursor``: a patient ID, or with ``sort`` a ``(value, patient_id)`` pair.
+
+    Anything else, including a cursor taken from a different endpoint, is a 400.
+    """
+    if cursor is None:
+        return None
+    try:
+        after = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if sort:
+        if isinstance(after, list) and len(after) == 2 and _is_sort_value(after[0]) and isinstance(after[1], str):
+            return tuple(after)
+    elif isinstance(after, str):
+        return after
+    raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def parse_fields(fields):
+    """Turn ``fields=name,city`` into a list of record keys, or ``None`` for all of them."""
+    if fields is None:
+        return None
+    selected = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in selected if name not in PATIENT_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Invalid fields {unknown}, select from {PATIENT_FIELDS}")
+    return selected
+
+
+def project(record, fields):
+    if fields is None:
+        return record
+    return {name: record[name] for name in fields if name in record}
+
+
+def page_response(items, fields, limit, next_after):
+    """One page as ``{"patients": {...}, "next_cursor": ...}``; ``next_cursor`` is ``None`` on the last page."""
+    next_cursor = None
+    if limit is not None and len(items) == limit:
+        next_cursor = encode_cursor(next_after(*items[-1]))
+    return {"patients": {patient_id: project(record, fields) for patient_id, record in items}, "next_cursor": next_cursor}
+
+
+def iter_records(fetch, next_after, after=None, limit=None, chunk=STREAM_CHUNK):
+    """Yield ``(patient_id, record)`` pairs, asking ``fetch(after, n)`` for ``chunk`` records at a time."""
+    remaining = limit
+    while remaining is None or remaining > 0:
+        n = chunk if remaining is None else min(chunk, remaining)
+        items = fetch(after, n)
+        yield from items
+        if len(items) < n:
+            return
+        after = next_after(*items[-1])
+        if remaining is not None:
+            remaining -= len(items)
+
+
+def ndjson_response(records, fields, chunk=STREAM_CHUNK):
+    """Stream one JSON object per line, so memory stays flat however many records there are.
+
+    Lines are sent ``chunk`` at a time; one send per record costs more than encoding it.
+    """
+    def lines():
+        batch = []
+        for patient_id, record in records:
+            batch.append(fast_json.dumps({"id": patient_id, **project(record, fields)}) + b"\n")
+            if len(batch) >= chunk:
+                yield b"".join(batch)
+                batch = []
+        if batch:
+            yield b"".join(batch)
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -0,0 +1,171 @@
+import heapq
+import os
+from abc import ABC, abstractmethod
+from collections import Counter
+from itertools import islice
+
+from patient_columns import PatientColumns, DEFAULT_PERCENTILES, AGE_BIN_WIDTH, MEMORY_SAMPLE
+from patient_index import sort_key
+
+EQUALITY_FILTERS = ("city", "gender", "verdict")
+RANGE_FILTERS = ("age", "bmi")
+FACET_FIELDS = ("verdict", "city")
+# verdicts found in older patients.json files, and the label Patient.verdict gives them now
+LEGACY_VERDICTS = {"Obese": "Obesity"}
+
+
+def normalize_record(record):
+    """``record`` with a legacy verdict label replaced by the current one (the same dict if there is none)."""
+    verdict = LEGACY_VERDICTS.get(record.get("verdict"))
+    return record if verdict is None else dict(record, verdict=verdict)
+
+
+def matches(record, filters):
+    """Check ``record`` against search filters: ``{"city": "Mumbai", "age": (30, 40), ...}``.
+
+    Equality filters compare exactly, range filters are inclusive ``(low, high)`` pairs
+    where ``None`` leaves a side open.
+    """
+    for field, value in filters.items():
+        if field in RANGE_FILTERS:
+            low, high = value
+            key = sort_key(record.get(field))
+            if key is None or (low is not None and key < low) or (high is not None and key > high):
+                return False
+        elif record.get(field) != value:
+            return False
+    return True
+
+
+def search_result(total, items, facets):
+    return {"total": total, "items": items, "facets": facets}
+
+
+class PatientBackend(ABC):
+    """Interface shared by the patient storage backends.
+
+    Records are plain dicts keyed by patient ID, without the ``id`` itself, exactly
+    as they appear in ``patients.json``. Every write gives the record a new ``version``
+    from a counter shared by the whole store, so a version is never reused, not even
+    after the patient is deleted and created again.
+    """
+
+    @abstractmethod
+    def all(self):
+        """Return every patient as a new ``{patient_id: record}`` dict."""
+
+    @abstractmethod
+    def get(self, patient_id):
+        """Return the record for ``patient_id``, or ``None``."""
+
+    @abstractmethod
+    def __contains__(self, patient_id):
+        ...
+
+    @abstractmethod
+    def __len__(self):
+        ...
+
+    @abstractmethod
+    def transaction(self):
+        """Context manager giving exclusive write access across threads and processes."""
+
+    @abstractmethod
+    def put(self, patient_id, record):
+        """Insert or replace a patient and return its new version number."""
+
+    def put_many(self, items):
+        """Insert or replace ``(patient_id, record)`` pairs in one transaction; returns their new versions."""
+        with self.transaction():
+            return [self.put(patient_id, record) for patient_id, record in items]
+
+    @abstractmethod
+    def delete(self, patient_id):
+        ...
+
+    @abstractmethod
+    def export_json(self, path):
+        ...
+
+    @abstractmethod
+    def import_json(self, path):
+        ...
+
+    @abstractmethod
+    def revision(self):
+        """Opaque string that changes on every write.
+
+        It depends only on the stored data, so every worker process sharing the
+        files returns the same value for the same state, and it never repeats.
+        """
+
+    def sorted_by(self, field, descending=False, limit=None, after=None):
+        """Return up to ``limit`` ``(patient_id, record)`` pairs ordered by ``(field, patient_id)``.
+
+        Records without a numeric ``field`` come last in either order. ``after`` is the
+        ``(value, patient_id)`` of the last record of the previous page.
+        """
+        keyed = [(sort_key(record.get(field)), patient_id, record) for patient_id, record in self.all().items()]
+        ordered = sorted(((k, p, r) for k, p, r in keyed if k is not None), reverse=descending)
+        ordered += sorted(((k, p, r) for k, p, r in keyed if k is None), key=lambda item: item[1])
+        if after is not None:
+            key, last_id = after
+
+            def is_after(item):
+                if key is None:
+                    return item[0] is None and item[1] > last_id
+                if item[0] is None:
+                    return True
+                return item[:2] < (key, last_id) if descending else item[:2] > (key, last_id)
+
+            ordered = [item for item in ordered if is_after(item)]
+        return [(patient_id, record) for _, patient_id, record in islice(ordered, limit)]
+
+    def page(self, after=None, limit=None):
+        """Return up to ``limit`` ``(patient_id, record)`` pairs in patient ID order, starting after ``after``."""
+        items = sorted(item for item in self.all().items() if after is None or item[0] > after)
+        return items[:limit]
+
+    def search(self, filters, limit=None, after=None):
+        """Patients matching ``filters`` (see :func:`matches`), in patient ID order after ``after``.
+
+        Returns ``{"total": ..., "items": [(patient_id, record), ...], "facets": {...}}`` where
+        ``facets`` counts every match (not just this page) per ``verdict`` and ``city``.
+        """
+        found = [(patient_id, record) for patient_id, record in self.all().items() if matches(record, filters)]
+        facets = {field: dict(Counter(record.get(field) for _, record in found)) for field in FACET_FIELDS}
+        page = (item for item in found if after is None or item[0] > after)
+        items = heapq.nsmallest(limit, page) if limit is not None else sorted(page)
+        return search_result(len(found), items, facets)
+
+    def stats(self, percentiles=DEFAULT_PERCENTILES, age_bin=AGE_BIN_WIDTH):
+        """Population statistics (see :meth:`PatientColumns.stats`) plus a ``memory`` comparison.
+
+        Backends that don't keep a :class:`PatientColumns` table up to date build one per call.
+        """
+        data = self.all()
+        columns = PatientColumns()
+        columns.rebuild(data)
+        return dict(columns.stats(percentiles, age_bin), memory=columns.memory(islice(data.values(), MEMORY_SAMPLE)))
+
+    def close(self):
+        pass
+
+
+def open_store(backend=None, path=None):
+    """Create the backend selected by ``PATIENT_STORE`` (``json`` or ``sqlite``).
+
+    ``PATIENT_DB`` overrides the file it uses (``patients.json`` / ``patients.db``), and
+    ``PATIENT_SQLITE_INDEXES`` is a comma separated list of columns to index in SQLite.
+    """
+    backend = backend or os.environ.get("PATIENT_STORE", "json")
+    path = path or os.environ.get("PATIENT_DB")
+    if backend == "json":
+        from patient_store import PatientStore
+        return PatientStore(path or "patients.json", columnar=os.environ.get("PATIENT_COLUMNAR", "0") == "1")
+    if backend == "sqlite":
+        from patient_sqlite import SQLitePatientStore, DEFAULT_INDEXES
+        indexes = os.environ.get("PATIENT_SQLITE_INDEXES")
+        indexes = [name.strip() for name in indexes.split(",") if name.strip()] if indexes is not None else DEFAULT_INDEXES
+        return SQLitePatientStore(path or "patients.db", indexes=indexes)
+    raise ValueError(f"Unknown patient store {backend!r}, use 'json' or 'sqlite'")
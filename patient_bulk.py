@@ -0,0 +1,153 @@
+import csv
+import io
+import time
+
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+
+import fast_json
+from pagination import PATIENT_FIELDS, project
+
+BULK_CHUNK = 1000
+MAX_REPORTED_ERRORS = 100
+
+
+async def read_lines(stream):
+    """Yield ``(line_number, line)`` for every line of an async stream of byte chunks, without the newline."""
+    buffer, number = b"", 0
+    async for data in stream:
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            number += 1
+            yield number, line.rstrip(b"\r")
+    if buffer.strip():
+        yield number + 1, buffer.rstrip(b"\r")
+
+
+async def ndjson_rows(lines):
+    """Yield ``(line_number, row, error)`` for NDJSON input; ``row`` is ``None`` when ``error`` is set."""
+    async for number, line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield number, fast_json.loads(line), None
+        except ValueError:
+            yield number, None, "invalid JSON"
+
+
+async def csv_rows(lines):
+    """Yield ``(line_number, row, error)`` for CSV input with a header line.
+
+    A quoted value may span lines, so physical lines are gathered until their quotes
+    balance; ``line_number`` is where the record starts.
+    """
+    header, pending, start = None, [], None
+    async for number, line in lines:
+        try:
+            text = line.decode("utf-8-sig" if number == 1 else "utf-8")
+        except UnicodeDecodeError:
+            yield number, None, "invalid UTF-8"
+            continue
+        if not pending:
+            if not text.strip():
+                continue
+            start = number
+        pending.append(text)
+        if sum(part.count('"') for part in pending) % 2:
+            continue  # inside a quoted value
+        values = next(csv.reader(["\n".join(pending)]))
+        pending = []
+        if header is None:
+            header = [name.strip() for name in values]
+        elif len(values) != len(header):
+            yield start, None, f"expected {len(header)} columns, got {len(values)}"
+        else:
+            yield start, dict(zip(header, values)), None
+    if pending:
+        yield start, None, "unterminated quoted value"
+
+
+def validate_chunk(adapter, rows):
+    """Validate ``[(line_number, row)]`` with one call to ``adapter`` (a ``TypeAdapter(list[Model])``).
+
+    Returns ``(valid, errors)``: ``[(line_number, model)]`` and ``[(line_number, message)]``.
+    Rows that fail don't stop the others; they are dropped and the rest validated again.
+    """
+    try:
+        return list(zip([number for number, _ in rows], adapter.validate_python([row for _, row in rows]))), []
+    except ValidationError as exc:
+        failed = {}
+        for error in exc.errors(include_url=False):
+            index, *field = error["loc"]
+            failed.setdefault(index, []).append(f"{'.'.join(map(str, field)) or 'row'}: {error['msg']}")
+    errors = [(rows[index][0], "; ".join(messages)) for index, messages in failed.items()]
+    remaining = [row for index, row in enumerate(rows) if index not in failed]
+    valid, _ = validate_chunk(adapter, remaining) if remaining else ([], [])
+    return valid, errors
+
+
+async def ingest(rows, commit, chunk=BULK_CHUNK):
+    """Feed ``rows`` (from :func:`ndjson_rows` / :func:`csv_rows`) to ``commit`` ``chunk`` rows at a time.
+
+    ``commit([(line_number, row)])`` runs in the thread pool and returns
+    ``(accepted, [(line_number, message)])``. Returns the import summary.
+    """
+    accepted, rejected, errors = 0, 0, []
+    start = time.perf_counter()
+
+    def reject(number, message):
+        nonlocal rejected
+        rejected += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({"line": number, "error": message})
+
+    async def flush(batch):
+        nonlocal accepted
+        n, failed = await run_in_threadpool(commit, batch)
+        accepted += n
+        for number, message in sorted(failed):
+            reject(number, message)
+
+    batch = []
+    async for number, row, error in rows:
+        if error is not None:
+            reject(number, error)
+            continue
+        batch.append((number, row))
+        if len(batch) >= chunk:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+
+    elapsed = time.perf_counter() - start
+    errors.sort(key=lambda error: error["line"])
+    return {
+        "accepted": accepted,
+        "rejected": rejected,
+        "errors": errors,
+        "errors_truncated": rejected > len(errors),
+        "seconds": round(elapsed, 3),
+        "records_per_second": round(accepted / elapsed, 1) if elapsed else None,
+    }
+
+
+def csv_response(records, fields, chunk=BULK_CHUNK):
+    """Stream ``(patient_id, record)`` pairs as CSV with a header line, ``chunk`` records per write."""
+    columns = ["id", *(fields or PATIENT_FIELDS)]
+
+    def lines():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(columns)
+        for n, (patient_id, record) in enumerate(records, 1):
+            row = project(record, fields)
+            writer.writerow([patient_id, *(row.get(name) for name in columns[1:])])
+            if n % chunk == 0:
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode()
+    return StreamingResponse(lines(), media_type="text/csv")
@@ -0,0 +1,226 @@
+import sys
+
+import numpy as np
+
+from patient_index import sort_key
+
+NUMERIC_COLUMNS = ("age", "height", "weight", "bmi")
+CATEGORICAL_COLUMNS = ("city", "gender", "verdict")
+COLUMNS = NUMERIC_COLUMNS + CATEGORICAL_COLUMNS
+DEFAULT_PERCENTILES = (50, 90, 99)
+AGE_BIN_WIDTH = 10
+MAX_AGE = 120
+MEMORY_SAMPLE = 1000
+
+
+def _number(value):
+    key = sort_key(value)
+    return np.nan if key is None else key
+
+
+def group_stats(codes, values, groups, percentiles):
+    """Count, mean and ``percentiles`` of ``values`` per group code in ``range(groups)``.
+
+    NaNs are left out. One sort orders the values inside every group at once and the
+    percentiles interpolate linearly between the closest ranks (NumPy's default), so
+    the cost doesn't depend on the number of groups. Returns ``(counts, means, table)``
+    where ``table[g, i]`` is percentile ``percentiles[i]`` of group ``g``; empty groups get NaN.
+    """
+    known = ~np.isnan(values)
+    codes, values = codes[known], values[known]
+    counts = np.bincount(codes, minlength=groups)
+    sizes = np.maximum(counts, 1)
+    means = np.bincount(codes, weights=values, minlength=groups) / sizes
+    if len(values):
+        # shift each group into its own band of width ``span``: a plain float sort then orders
+        # by (group, value), an order of magnitude faster than an argsort or lexsort
+        floor = values.min()
+        span = values.max() - floor + 1
+        offsets = np.arange(groups) * span
+        values = np.sort(codes * span + (values - floor)) - np.repeat(offsets, counts) + floor
+    starts = np.cumsum(counts) - counts
+    position = starts[:, None] + (sizes[:, None] - 1) * (np.asarray(percentiles, dtype=float) / 100)
+    low = np.floor(position).astype(np.int64)
+    high = np.minimum(low + 1, (starts + sizes - 1)[:, None])
+    table = np.full(position.shape, np.nan)
+    present = counts > 0
+    table[present] = values[low[present]] + (values[high[present]] - values[low[present]]) * (position - low)[present]
+    means[~present] = np.nan
+    return counts, means, table
+
+
+class PatientColumns:
+    """The numeric and categorical patient fields as NumPy columns, one row per patient.
+
+    ``age``/``height``/``weight``/``bmi`` are float64 arrays (NaN where a record has no
+    usable number) and ``city``/``gender``/``verdict`` are int32 codes into a list of
+    the distinct values seen, so a statistic over the whole population is a handful of
+    array operations instead of a loop over dicts. Rows stay dense: a deleted
+    patient's row is filled with the last row. Arrays grow by doubling.
+
+    It follows writes like the indexes in :mod:`patient_index`: ``rebuild(data)``,
+    ``update(patient_id, old, new)`` and ``update_many(changes)``.
+    """
+
+    def __init__(self, capacity=1024):
+        self._allocate(capacity)
+        self._n = 0
+        self._ids = []
+        self._rows = {}
+        self._values = {field: [] for field in CATEGORICAL_COLUMNS}
+        self._codes = {field: {} for field in CATEGORICAL_COLUMNS}
+
+    def _allocate(self, capacity, keep=0):
+        numeric = {field: np.full(capacity, np.nan) for field in NUMERIC_COLUMNS}
+        categorical = {field: np.zeros(capacity, dtype=np.int32) for field in CATEGORICAL_COLUMNS}
+        if keep:
+            for field, column in (*numeric.items(), *categorical.items()):
+                column[:keep] = self._column(field)[:keep]
+        self._numeric, self._categorical = numeric, categorical
+
+    def _column(self, field):
+        return self._numeric[field] if field in self._numeric else self._categorical[field]
+
+    def _code(self, field, value):
+        codes = self._codes[field]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+            self._values[field].append(value)
+        return code
+
+    @classmethod
+    def from_rows(cls, rows):
+        """A table to read statistics from, filled from ``COLUMNS``-ordered tuples such as an SQL result.
+
+        It has no patient IDs, so it can't follow writes.
+        """
+        columns = cls()
+        columns._load(len(rows), list(zip(*rows)) or [()] * len(COLUMNS))
+        return columns
+
+    def _load(self, n, values):
+        self._allocate(max(1024, n + n // 4))
+        self._values = {field: [] for field in CATEGORICAL_COLUMNS}
+        self._codes = {field: {} for field in CATEGORICAL_COLUMNS}
+        for field, column in zip(COLUMNS, values):
+            if field in self._numeric:
+                try:
+                    self._numeric[field][:n] = np.array(column, dtype=float)  # None becomes NaN
+                except (TypeError, ValueError):
+                    self._numeric[field][:n] = np.fromiter(map(_number, column), float, n)
+            else:
+                codes = self._codes[field]
+                self._categorical[field][:n] = [codes.setdefault(value, len(codes)) for value in column]
+                self._values[field] = list(codes)
+        self._n = n
+
+    def rebuild(self, data):
+        records = data.values()
+        self._load(len(data), [[record.get(field) for record in records] for field in COLUMNS])
+        self._ids = list(data)
+        self._rows = {patient_id: row for row, patient_id in enumerate(self._ids)}
+
+    def update(self, patient_id, old, new):
+        row = self._rows.get(patient_id)
+        if new is None:
+            if row is not None:
+                self._remove(patient_id, row)
+            return
+        if row is None:
+            if self._n == len(self._numeric["age"]):
+                self._allocate(2 * self._n, keep=self._n)
+            row = self._rows[patient_id] = self._n
+            self._ids.append(patient_id)
+            self._n += 1
+        for field in NUMERIC_COLUMNS:
+            self._numeric[field][row] = _number(new.get(field))
+        for field in CATEGORICAL_COLUMNS:
+            self._categorical[field][row] = self._code(field, new.get(field))
+
+    def update_many(self, changes):
+        for change in changes:
+            self.update(*change)
+
+    def _remove(self, patient_id, row):
+        last = self._n - 1
+        if row != last:
+            for field in COLUMNS:
+                column = self._column(field)
+                column[row] = column[last]
+            moved = self._ids[row] = self._ids[last]
+            self._rows[moved] = row
+        self._ids.pop()
+        del self._rows[patient_id]
+        self._n = last
+
+    def __len__(self):
+        return self._n
+
+    # statistics
+
+    def _distribution(self, field):
+        counts = np.bincount(self._categorical[field][:self._n], minlength=len(self._values[field]))
+        return {value: int(count) for value, count in zip(self._values[field], counts.tolist()) if count}
+
+    def stats(self, percentiles=DEFAULT_PERCENTILES, age_bin=AGE_BIN_WIDTH):
+        """Population statistics, computed on the columns without touching a record.
+
+        BMI mean and percentiles overall and per city, patients per verdict and per
+        gender, and an age histogram in ``age_bin`` year bins, overall and per gender.
+        """
+        n = self._n
+        names = [f"p{p:g}" for p in percentiles]
+        bmi = self._numeric["bmi"][:n]
+
+        def summary(count, mean, row):
+            return {"count": int(count), "mean": None if np.isnan(mean) else round(float(mean), 2),
+                    **{name: None if np.isnan(value) else round(float(value), 2) for name, value in zip(names, row)}}
+
+        counts, means, table = group_stats(np.zeros(n, dtype=np.int32), bmi, 1, percentiles)
+        cities = self._values["city"]
+        city_counts, city_means, city_table = group_stats(self._categorical["city"][:n], bmi, len(cities), percentiles)
+
+        edges = np.arange(0, MAX_AGE + age_bin, age_bin)
+        age = self._numeric["age"][:n]
+        known = ~np.isnan(age)
+        bins = np.clip(age[known] // age_bin, 0, len(edges) - 2).astype(np.int64)
+        genders = self._values["gender"]
+        by_gender = np.bincount(self._categorical["gender"][:n][known] * (len(edges) - 1) + bins,
+                                minlength=len(genders) * (len(edges) - 1)).reshape(len(genders), len(edges) - 1)
+
+        return {
+            "patients": n,
+            "bmi": summary(counts[0], means[0], table[0]),
+            "bmi_by_city": {city: summary(city_counts[code], city_means[code], city_table[code])
+                            for code, city in enumerate(cities) if city_counts[code]},
+            "verdicts": self._distribution("verdict"),
+            "genders": self._distribution("gender"),
+            "age_histogram": {
+                "edges": edges.tolist(),
+                "all": by_gender.sum(axis=0).tolist(),
+                "by_gender": {gender: row for gender, row in zip(genders, by_gender.tolist()) if any(row)},
+            },
+        }
+
+    def memory(self, sample):
+        """Bytes per patient of the columns against the same fields as dicts, over ``sample`` records.
+
+        The dict figure counts the dict plus every value object it holds once (keys are
+        shared between records); the column figure is the arrays' share per row.
+        """
+        sample = list(sample)
+        seen, dict_bytes = set(), 0
+        for record in sample:
+            fields = {field: record.get(field) for field in COLUMNS}
+            dict_bytes += sys.getsizeof(fields)
+            for value in fields.values():
+                if id(value) not in seen:
+                    seen.add(id(value))
+                    dict_bytes += sys.getsizeof(value)
+        row_bytes = sum(self._column(field).itemsize for field in COLUMNS)
+        return {
+            "columnar_bytes_per_record": row_bytes,
+            "columnar_allocated_bytes": sum(self._column(field).nbytes for field in COLUMNS),
+            "dict_bytes_per_record": round(dict_bytes / len(sample), 1) if sample else None,
+        }
@@ -0,0 +1,232 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+
+# below this many changes inserting one at a time beats re-merging the whole sorted list
+MERGE_BATCH = 256
+
+
+def sort_key(value):
+    """Numeric sort key for a record field, or ``None`` if it can't be ordered as a number.
+
+    ``bool`` is not a number here, and strings that hold numbers (old hand-edited files)
+    are accepted, so a mix of types never makes a comparison blow up.
+    """
+    if isinstance(value, bool) or value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _splice(items, removed, added):
+    """A new sorted list: ``items`` without ``removed`` and with ``added``, in one pass of slice copies."""
+    if removed:
+        kept, start = [], 0
+        for item in sorted(removed):
+            i = bisect_left(items, item, start)
+            if i < len(items) and items[i] == item:
+                kept += items[start:i]
+                start = i + 1
+        items = kept + items[start:]
+    if not added:
+        return items
+    merged, start = [], 0
+    for item in sorted(added):
+        i = bisect_left(items, item, start)
+        merged += items[start:i]
+        merged.append(item)
+        start = i
+    return merged + items[start:]
+
+
+class SortedIndex:
+    """Patient IDs kept in order of one numeric field.
+
+    Entries are ``(value, patient_id)`` tuples in a list kept sorted with ``bisect``,
+    so a write costs one binary search plus a list insert/delete, and reading
+    ``k`` IDs from any position in either direction is a slice. Records without a
+    usable value are kept apart in a sorted list of IDs and always come last, in
+    patient ID order, like in the other backends.
+
+    ``key(patient_id, record)`` overrides how the value is taken from a record.
+    """
+
+    def __init__(self, field, key=None):
+        self.field = field
+        self.key = key or (lambda patient_id, record: sort_key(record.get(field)))
+        self._entries = []
+        self._missing = []
+
+    def rebuild(self, data):
+        entries, missing = [], []
+        for patient_id, record in data.items():
+            key = self.key(patient_id, record)
+            if key is None:
+                missing.append(patient_id)
+            else:
+                entries.append((key, patient_id))
+        entries.sort()
+        missing.sort()
+        self._entries, self._missing = entries, missing
+
+    def _list(self, key, patient_id):
+        # the sorted list a record belongs in, and its item there
+        return (self._missing, patient_id) if key is None else (self._entries, (key, patient_id))
+
+    def add(self, patient_id, record):
+        insort(*self._list(self.key(patient_id, record), patient_id))
+
+    def remove(self, patient_id, record):
+        items, item = self._list(self.key(patient_id, record), patient_id)
+        i = bisect_left(items, item)
+        if i < len(items) and items[i] == item:
+            del items[i]
+
+    def update(self, patient_id, old, new):
+        if old is not None:
+            self.remove(patient_id, old)
+        if new is not None:
+            self.add(patient_id, new)
+
+    def update_many(self, changes):
+        """Apply ``(patient_id, old, new)`` changes in order.
+
+        A large batch is spliced into the sorted list in one pass (a binary search
+        per change and slice copies in between) instead of one ``insort``, and one
+        shift of the whole list, per record. The new list is swapped in whole, so
+        concurrent readers never see it half built.
+        """
+        if len(changes) < MERGE_BATCH:
+            for change in changes:
+                self.update(*change)
+            return
+        # for the valued entries and for the IDs without a value: what to take out and what to put in
+        removed, added = (set(), set()), ({}, {})
+        for patient_id, old, new in changes:
+            if old is not None:
+                key = self.key(patient_id, old)
+                _, item = self._list(key, patient_id)
+                if added[key is None].pop(item, False) is False:
+                    removed[key is None].add(item)
+            if new is not None:
+                key = self.key(patient_id, new)
+                added[key is None][self._list(key, patient_id)[1]] = None
+        self._entries = _splice(self._entries, removed[False], added[False])
+        self._missing = _splice(self._missing, removed[True], added[True])
+
+    def __len__(self):
+        return len(self._entries) + len(self._missing)
+
+    def position_after(self, cursor, descending=False):
+        """Position just past ``cursor``, a ``(value, patient_id)`` pair from an earlier page.
+
+        The cursor doesn't have to be in the index any more, which keeps paging stable
+        while records are written.
+        """
+        key, patient_id = cursor
+        n = len(self._entries)
+        if key is None:
+            return n + bisect_right(self._missing, patient_id)
+        if descending:
+            return n - bisect_left(self._entries, (key, patient_id))
+        return bisect_right(self._entries, (key, patient_id))
+
+    def ids(self, descending=False, start=0, limit=None):
+        """Return up to ``limit`` patient IDs from position ``start`` in the requested order."""
+        n = len(self._entries)
+        stop = len(self) if limit is None else min(len(self), start + limit)
+        if descending:
+            # walk the sorted entries backwards without reversing the whole list
+            first, last = n - min(stop, n), n - min(start, n)
+            ids = [patient_id for _, patient_id in reversed(self._entries[first:last])]
+        else:
+            ids = [patient_id for _, patient_id in self._entries[min(start, n):min(stop, n)]]
+        if stop > n:
+            ids.extend(self._missing[max(start - n, 0):stop - n])
+        return ids
+
+    def ids_between(self, low=None, high=None):
+        """Patient IDs whose value lies in ``[low, high]``; ``None`` leaves that side open."""
+        start = 0 if low is None else bisect_left(self._entries, low, key=lambda entry: entry[0])
+        stop = len(self._entries) if high is None else bisect_right(self._entries, high, key=lambda entry: entry[0])
+        return [patient_id for _, patient_id in self._entries[start:stop]]
+
+
+class InvertedIndex:
+    """Patient IDs grouped by the exact value of one field (e.g. every patient in "Mumbai")."""
+
+    def __init__(self, field):
+        self.field = field
+        self._ids = {}
+
+    def rebuild(self, data):
+        self._ids = {}
+        for patient_id, record in data.items():
+            self.add(patient_id, record)
+
+    def add(self, patient_id, record):
+        self._ids.setdefault(record.get(self.field), set()).add(patient_id)
+
+    def remove(self, patient_id, record):
+        value = record.get(self.field)
+        ids = self._ids.get(value)
+        if ids is not None:
+            ids.discard(patient_id)
+            if not ids:
+                del self._ids[value]
+
+    def update(self, patient_id, old, new):
+        if old is not None:
+            self.remove(patient_id, old)
+        if new is not None:
+            self.add(patient_id, new)
+
+    def update_many(self, changes):
+        for change in changes:
+            self.update(*change)
+
+    def ids(self, value):
+        return self._ids.get(value, frozenset())
+
+
+class FacetCounts:
+    """Number of patients for every combination of a few categorical fields.
+
+    The table holds one counter per distinct combination (a few thousand at most
+    for city x gender x verdict), so the counts for any equality filter are a sum
+    over that table instead of a scan over the patients.
+    """
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self._counts = Counter()
+
+    def _key(self, record):
+        return tuple(record.get(field) for field in self.fields)
+
+    def rebuild(self, data):
+        self._counts = Counter(self._key(record) for record in data.values())
+
+    def update(self, patient_id, old, new):
+        if old is not None:
+            key = self._key(old)
+            self._counts[key] -= 1
+            if not self._counts[key]:
+                del self._counts[key]
+        if new is not None:
+            self._counts[self._key(new)] += 1
+
+    def update_many(self, changes):
+        for change in changes:
+            self.update(*change)
+
+    def facets(self, facet_fields, where):
+        """Count per value of each of ``facet_fields`` over the patients matching ``where`` ({field: value})."""
+        positions = {field: self.fields.index(field) for field in (*facet_fields, *where)}
+        result = {field: Counter() for field in facet_fields}
+        for key, count in self._counts.items():
+            if all(key[positions[field]] == value for field, value in where.items()):
+                for field in facet_fields:
+                    result[field][key[positions[field]]] += count
+        return {field: dict(counts) for field, counts in result.items()}
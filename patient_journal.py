@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+
+import fast_json
+
+
+class PatientJournal:
+    """Append-only log of patient mutations.
+
+    Each line is one JSON record, either ``{"op": "put", "id": ..., "record": {...}}``
+    or ``{"op": "del", "id": ...}``. Records always carry the full patient, so
+    replaying a line twice gives the same result as replaying it once. A rotated
+    log starts with ``{"op": "seq", "version": ...}``, the highest record version
+    handed out so far, so versions keep counting up after the old log is folded away.
+
+    Appends are flushed to the OS straight away, but ``fsync`` is batched: it runs
+    once ``fsync_batch`` records are pending or ``fsync_interval`` seconds have
+    passed, whichever comes first (a background thread covers the quiet periods).
+    """
+
+    def __init__(self, path, fsync_batch=64, fsync_interval=0.05):
+        self.path = path
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self._file = None
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = None
+
+    # reading
+
+    @staticmethod
+    def replay_file(path, data, offset=0, on_change=None):
+        """Apply the complete records of ``path`` from ``offset`` onwards to ``data``.
+
+        Returns the offset just past the last complete line and the highest record
+        version among the lines read (0 if none). A trailing line with no newline (a
+        write cut short by a crash, or one still in progress) is left alone.
+        ``on_change(patient_id, old_record, new_record)`` is called for every applied record.
+        """
+        version = 0
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return 0, version
+        with f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                if not line.strip():
+                    continue
+                entry = fast_json.loads(line)
+                if entry["op"] == "seq":
+                    version = max(version, entry["version"])
+                    continue
+                old = data.get(entry["id"])
+                if entry["op"] == "put":
+                    new = data[entry["id"]] = entry["record"]
+                    version = max(version, new.get("version", 0))
+                elif entry["op"] == "del":
+                    data.pop(entry["id"], None)
+                    new = None
+                else:
+                    continue
+                if on_change is not None:
+                    on_change(entry["id"], old, new)
+        return offset, version
+
+    def replay(self, data, offset=0, on_change=None):
+        return self.replay_file(self.path, data, offset, on_change)
+
+    def stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None, 0
+        return st.st_ino, st.st_size
+
+    # writing
+
+    def _open(self):
+        if self._file is not None and os.fstat(self._file.fileno()).st_ino != self.stamp()[0]:
+            # another worker rotated the journal; keep writing to the live file, not the old one
+            self._file.close()
+            self._file = None
+        if self._file is None:
+            self._file = open(self.path, "ab")
+            # drop a torn record left by a crash so the next append starts on a clean line
+            # (callers hold the store's write lock, so this can't cut into another worker's append)
+            end, _ = self.replay_file(self.path, {})
+            if self._file.tell() != end:
+                self._file.truncate(end)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+                self._flusher.start()
+        return self._file
+
+    def append(self, op, patient_id, record=None):
+        self.append_many([(op, patient_id, record)])
+
+    def append_many(self, entries):
+        """Append ``(op, patient_id, record)`` entries with a single write and flush."""
+        lines = []
+        for op, patient_id, record in entries:
+            entry = {"op": op, "id": patient_id}
+            if op == "put":
+                entry["record"] = record
+            lines.append(fast_json.dumps(entry) + b"\n")
+        with self._lock:
+            f = self._open()
+            f.write(b"".join(lines))
+            f.flush()
+            self._pending += len(lines)
+            if self._pending >= self.fsync_batch or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        if self._file is not None and self._pending:
+            os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.fsync_interval):
+            if self._pending:
+                self.sync()
+
+    def rotate(self, old_path, version=0):
+        """Move the current log to ``old_path`` and start a fresh one holding only ``version``."""
+        with self._lock:
+            self._sync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.path):
+                os.replace(self.path, old_path)
+            f = self._open()
+            f.write(fast_json.dumps({"op": "seq", "version": version}) + b"\n")
+            f.flush()
+            self._pending += 1
+            self._sync()
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            self._sync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,275 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import fast_json
+from patient_backend import (PatientBackend, EQUALITY_FILTERS, RANGE_FILTERS, FACET_FIELDS, LEGACY_VERDICTS,
+                             normalize_record, search_result)
+from patient_columns import PatientColumns, COLUMNS as STAT_COLUMNS, DEFAULT_PERCENTILES, AGE_BIN_WIDTH, MEMORY_SAMPLE
+
+COLUMNS = ("name", "city", "age", "gender", "height", "weight", "bmi", "verdict", "version")
+INDEXABLE = ("city", "gender", "age", "height", "weight", "bmi", "verdict")
+DEFAULT_INDEXES = ["city", "gender", "age", "bmi"]
+
+SELECT_ALL = f"SELECT id, {', '.join(COLUMNS)} FROM patients ORDER BY rowid"
+SELECT_ONE = f"SELECT id, {', '.join(COLUMNS)} FROM patients WHERE id = ?"
+SELECT_VERSION = "SELECT version FROM patients WHERE id = ?"
+SELECT_STATS = f"SELECT {', '.join(STAT_COLUMNS)} FROM patients"
+UPSERT = (
+    f"INSERT INTO patients (id, {', '.join(COLUMNS)}) VALUES ({', '.join('?' * (len(COLUMNS) + 1))}) "
+    f"ON CONFLICT(id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in COLUMNS)}"
+)
+DELETE = "DELETE FROM patients WHERE id = ?"
+SELECT_REVISION = "SELECT value FROM meta WHERE key = 'revision'"
+BUMP_REVISION = "UPDATE meta SET value = value + 1 WHERE key = 'revision'"
+SELECT_LEGACY_VERDICTS = f"SELECT id, verdict FROM patients WHERE verdict IN ({', '.join('?' * len(LEGACY_VERDICTS))})"
+UPDATE_VERDICT = "UPDATE patients SET verdict = ?, version = ? WHERE id = ?"
+# hands out the next ``?`` record versions and returns the last of them
+TAKE_VERSIONS = "UPDATE meta SET value = value + ? WHERE key = 'version' RETURNING value"
+
+
+class SQLitePatientStore(PatientBackend):
+    """Patient backend on an SQLite database in WAL mode.
+
+    Columns listed in ``indexes`` get a B-tree index, so sorting and filtering on
+    them doesn't scan the table. Connections are pooled and every query is a
+    constant SQL string, so SQLite's per-connection statement cache reuses the
+    prepared statements. On first use an empty database is filled from ``import_from``.
+    """
+
+    def __init__(self, path="patients.db", indexes=DEFAULT_INDEXES, pool_size=8, import_from="patients.json"):
+        unknown = set(indexes) - set(INDEXABLE)
+        if unknown:
+            raise ValueError(f"Cannot index {sorted(unknown)}, select from {list(INDEXABLE)}")
+        self.path = path
+        self.indexes = list(indexes)
+        self.pool_size = pool_size
+        self._pool = queue.LifoQueue()
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS patients (id TEXT PRIMARY KEY, name TEXT, city TEXT, age INTEGER, "
+                "gender TEXT, height REAL, weight REAL, bmi REAL, verdict TEXT, version INTEGER NOT NULL DEFAULT 1)"
+            )
+            # bumped by every write through this class, so all processes agree on revision()
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('revision', 0)")
+            # one version counter for the whole table, so a deleted and recreated ID never gets an old version back
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) SELECT 'version', COALESCE(MAX(version), 0) FROM patients")
+            for column in INDEXABLE:
+                if column in self.indexes:
+                    # the id tie-breaker makes the index match the (value, id) keyset used for paging
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_patients_{column} ON patients ({column}, id)")
+                else:
+                    conn.execute(f"DROP INDEX IF EXISTS idx_patients_{column}")
+        if import_from and len(self) == 0 and os.path.exists(import_from):
+            self.import_json(import_from)
+        self._normalize_verdicts()
+
+    # connections
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        # inside a transaction the thread keeps using the connection that opened it
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            if self._pool.qsize() < self.pool_size:
+                self._pool.put(conn)
+            else:
+                conn.close()
+
+    @staticmethod
+    def _row(row):
+        return row[0], dict(zip(COLUMNS, row[1:]))
+
+    # reads
+
+    def all(self):
+        with self._connection() as conn:
+            return dict(self._row(row) for row in conn.execute(SELECT_ALL))
+
+    def revision(self):
+        with self._connection() as conn:
+            return str(conn.execute(SELECT_REVISION).fetchone()[0])
+
+    def get(self, patient_id):
+        with self._connection() as conn:
+            row = conn.execute(SELECT_ONE, (patient_id,)).fetchone()
+        return None if row is None else self._row(row)[1]
+
+    def __contains__(self, patient_id):
+        with self._connection() as conn:
+            return conn.execute(SELECT_VERSION, (patient_id,)).fetchone() is not None
+
+    def __len__(self):
+        with self._connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0]
+
+    def sorted_by(self, field, descending=False, limit=None, after=None):
+        if field not in INDEXABLE:
+            raise ValueError(f"Cannot sort on {field!r}")
+        direction, compare = ("DESC", "<") if descending else ("ASC", ">")
+        columns = ", ".join(COLUMNS)
+        limit = -1 if limit is None else limit
+        rows = []
+        with self._connection() as conn:
+            # ordering on (column, id) lets SQLite walk the index; NULLs are fetched
+            # separately so they come last in either order, like the in-memory indexes
+            if after is None or after[0] is not None:
+                where, params = f"{field} IS NOT NULL", ()
+                if after is not None:
+                    where, params = f"{field} IS NOT NULL AND ({field}, id) {compare} (?, ?)", tuple(after)
+                query = f"SELECT id, {columns} FROM patients WHERE {where} ORDER BY {field} {direction}, id {direction} LIMIT ?"
+                rows = conn.execute(query, (*params, limit)).fetchall()
+            if limit < 0 or len(rows) < limit:
+                last_id = after[1] if after is not None and after[0] is None else ""
+                query = f"SELECT id, {columns} FROM patients WHERE {field} IS NULL AND id > ? ORDER BY id LIMIT ?"
+                rows += conn.execute(query, (last_id, limit - len(rows) if limit >= 0 else -1)).fetchall()
+        return [self._row(row) for row in rows]
+
+    def page(self, after=None, limit=None):
+        query = f"SELECT id, {', '.join(COLUMNS)} FROM patients WHERE id > ? ORDER BY id LIMIT ?"
+        with self._connection() as conn:
+            rows = conn.execute(query, ("" if after is None else after, -1 if limit is None else limit))
+            return [self._row(row) for row in rows]
+
+    def search(self, filters, limit=None, after=None):
+        clauses, params = [], []
+        for field, value in filters.items():
+            if field in EQUALITY_FILTERS:
+                clauses.append(f"{field} = ?")
+                params.append(value)
+            elif field in RANGE_FILTERS:
+                low, high = value
+                if low is not None:
+                    clauses.append(f"{field} >= ?")
+                    params.append(low)
+                if high is not None:
+                    clauses.append(f"{field} <= ?")
+                    params.append(high)
+        where = " AND ".join(clauses) or "1"
+        with self._connection() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM patients WHERE {where}", params).fetchone()[0]
+            facets = {
+                field: dict(conn.execute(f"SELECT {field}, COUNT(*) FROM patients WHERE {where} GROUP BY {field}", params).fetchall())
+                for field in FACET_FIELDS
+            }
+            rows = conn.execute(
+                f"SELECT id, {', '.join(COLUMNS)} FROM patients WHERE {where} AND id > ? ORDER BY id LIMIT ?",
+                (*params, "" if after is None else after, -1 if limit is None else limit),
+            )
+            items = [self._row(row) for row in rows]
+        return search_result(total, items, facets)
+
+    def stats(self, percentiles=DEFAULT_PERCENTILES, age_bin=AGE_BIN_WIDTH):
+        # only the seven columns the statistics need, straight into arrays without a dict per patient
+        with self._connection() as conn:
+            columns = PatientColumns.from_rows(conn.execute(SELECT_STATS).fetchall())
+        sample = [record for _, record in self.page(limit=MEMORY_SAMPLE)]
+        return dict(columns.stats(percentiles, age_bin), memory=columns.memory(sample))
+
+    # writes
+
+    @contextmanager
+    def transaction(self):
+        """``BEGIN IMMEDIATE`` takes SQLite's write lock, which also covers other worker processes."""
+        depth = getattr(self._local, "depth", 0)
+        if depth:
+            self._local.depth += 1
+            try:
+                yield self
+            finally:
+                self._local.depth -= 1
+            return
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._local.conn, self._local.depth = conn, 1
+            try:
+                yield self
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+            finally:
+                self._local.conn, self._local.depth = None, 0
+
+    def put(self, patient_id, record):
+        with self.transaction(), self._connection() as conn:
+            version = conn.execute(TAKE_VERSIONS, (1,)).fetchone()[0]
+            record = dict(record, version=version)
+            conn.execute(UPSERT, (patient_id, *(record.get(c) for c in COLUMNS)))
+            conn.execute(BUMP_REVISION)
+            return version
+
+    def put_many(self, items):
+        with self.transaction(), self._connection() as conn:
+            items = list(items)
+            first = conn.execute(TAKE_VERSIONS, (len(items),)).fetchone()[0] - len(items) + 1
+            versions = list(range(first, first + len(items)))
+            rows = [(patient_id, *(dict(record, version=version).get(c) for c in COLUMNS))
+                    for (patient_id, record), version in zip(items, versions)]
+            conn.executemany(UPSERT, rows)
+            conn.execute(BUMP_REVISION)
+            return versions
+
+    def delete(self, patient_id):
+        with self.transaction(), self._connection() as conn:
+            conn.execute(DELETE, (patient_id,))
+            conn.execute(BUMP_REVISION)
+
+    def _normalize_verdicts(self):
+        # rows imported before LEGACY_VERDICTS existed; each one changes, so it gets a new version
+        with self.transaction(), self._connection() as conn:
+            rows = conn.execute(SELECT_LEGACY_VERDICTS, tuple(LEGACY_VERDICTS)).fetchall()
+            if not rows:
+                return
+            first = conn.execute(TAKE_VERSIONS, (len(rows),)).fetchone()[0] - len(rows) + 1
+            conn.executemany(UPDATE_VERDICT, [(LEGACY_VERDICTS[verdict], version, patient_id)
+                                              for version, (patient_id, verdict) in enumerate(rows, first)])
+            conn.execute(BUMP_REVISION)
+
+    # import / export in the plain patients.json format
+
+    def export_json(self, path):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            fast_json.dump(self.all(), f)
+        os.replace(tmp, path)
+
+    def import_json(self, path):
+        with open(path, "rb") as f:
+            data = fast_json.load(f)
+        with self.transaction(), self._connection() as conn:
+            # imported records get fresh versions, so none repeats one this table has handed out
+            first = conn.execute(TAKE_VERSIONS, (len(data),)).fetchone()[0] - len(data) + 1
+            rows = [(patient_id, *(dict(normalize_record(record), version=version).get(c) for c in COLUMNS))
+                    for version, (patient_id, record) in enumerate(data.items(), first)]
+            conn.execute("DELETE FROM patients")
+            conn.executemany(UPSERT, rows)
+            conn.execute(BUMP_REVISION)
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
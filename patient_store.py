@@ -0,0 +1,351 @@
+import hashlib
+import heapq
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from itertools import islice
+
+import fast_json
+from patient_backend import (PatientBackend, EQUALITY_FILTERS, RANGE_FILTERS, FACET_FIELDS, matches, normalize_record,
+                             search_result)
+from patient_columns import PatientColumns, DEFAULT_PERCENTILES, AGE_BIN_WIDTH, MEMORY_SAMPLE
+from patient_index import SortedIndex, InvertedIndex, FacetCounts
+from patient_journal import PatientJournal
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single worker
+    fcntl = None
+
+
+class PatientStore(PatientBackend):
+    """In-memory patient store backed by a JSON snapshot and an append-only journal.
+
+    The current state is always ``patients.json`` (the snapshot) with the journal
+    replayed on top of it. Writes only append one journal record instead of
+    rewriting the whole file; once the journal grows past ``compact_threshold``
+    bytes it is folded into a fresh snapshot on a background thread.
+
+    Reads are served from memory. Every read checks the snapshot's inode/mtime/size
+    and the journal's inode/size, so changes made outside this process are picked up.
+
+    All writes run inside :meth:`transaction`, which holds a thread lock plus an
+    ``flock`` on ``patients.json.lock``, so several uvicorn workers can share the same
+    files. Every write stamps the record with a ``version`` taken from one counter for
+    the whole store, so a version number is never handed out twice, not even to a
+    patient deleted and created again.
+
+    The fields in ``sorted_fields`` (and the patient ID, for :meth:`page`) have a
+    :class:`SortedIndex` that is updated on every write, so :meth:`sorted_by` never
+    sorts the whole dataset. ``city``/``gender``/``verdict`` have an
+    :class:`InvertedIndex` and a :class:`FacetCounts` table for :meth:`search`.
+    With ``columnar`` a :class:`PatientColumns` table follows every write too, and
+    :meth:`stats` reads it instead of building one from every record.
+    """
+
+    def __init__(self, path="patients.json", journal_path=None, compact_threshold=4 * 1024 * 1024,
+                 fsync_batch=64, fsync_interval=0.05, sorted_fields=("height", "weight", "bmi", "age"), columnar=False):
+        self.path = path
+        self.journal_path = journal_path or path + ".journal"
+        self.compact_threshold = compact_threshold
+        self.journal = PatientJournal(self.journal_path, fsync_batch=fsync_batch, fsync_interval=fsync_interval)
+        self._data = {}
+        self._indexes = {field: SortedIndex(field) for field in sorted_fields}
+        self._indexes["id"] = SortedIndex("id", key=lambda patient_id, record: patient_id)
+        self._inverted = {field: InvertedIndex(field) for field in EQUALITY_FILTERS}
+        self._facets = FacetCounts(EQUALITY_FILTERS)
+        self._columns = PatientColumns() if columnar else None
+        # everything that has to follow each write
+        self._maintained = [*self._indexes.values(), *self._inverted.values(), self._facets]
+        if self._columns is not None:
+            self._maintained.append(self._columns)
+        self._snapshot_stamp = None
+        self._journal_inode = None
+        self._journal_offset = 0
+        self._last_version = 0
+        self._lock = threading.RLock()
+        self._lock_file = None
+        self._lock_depth = 0
+        self._compacting = False
+        self._compaction = None
+        self.refresh()
+
+    @property
+    def _old_journal_path(self):
+        return self.journal_path + ".old"
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _reload(self):
+        # snapshot + the journal being compacted (if any) + the live journal
+        while True:
+            stamp = self._file_stamp()
+            journal_inode, _ = self.journal.stamp()
+            data = {}
+            if stamp is not None:
+                with open(self.path, "rb") as f:
+                    data = fast_json.load(f)
+            _, old_version = PatientJournal.replay_file(self._old_journal_path, data)
+            offset, version = self.journal.replay(data)
+            # a compaction may have swapped the files while we were reading them
+            if stamp == self._file_stamp() and journal_inode == self.journal.stamp()[0]:
+                break
+        for patient_id, record in data.items():
+            data[patient_id] = normalize_record(record)
+        self._data = data
+        self._last_version = max(old_version, version, max((r.get("version", 0) for r in data.values()), default=0))
+        for index in self._maintained:
+            index.rebuild(data)
+        self._snapshot_stamp = stamp
+        self._journal_inode = journal_inode
+        self._journal_offset = offset
+
+    def refresh(self):
+        # cheap stat() calls; files are only read when something changed
+        stamp = self._file_stamp()
+        journal_inode, journal_size = self.journal.stamp()
+        if (stamp == self._snapshot_stamp and journal_inode == self._journal_inode
+                and journal_size == self._journal_offset):
+            return
+        with self._lock:
+            stamp = self._file_stamp()
+            journal_inode, journal_size = self.journal.stamp()
+            if stamp != self._snapshot_stamp or journal_inode != self._journal_inode or journal_size < self._journal_offset:
+                self._reload()
+            elif journal_size > self._journal_offset:
+                # only the tail of the journal is new
+                self._journal_offset, version = self.journal.replay(self._data, self._journal_offset, self._index_change)
+                self._last_version = max(self._last_version, version)
+
+    def revision(self):
+        # the snapshot's stamp plus how far into which journal this process has read: the
+        # same in every worker for the same data, and it moves on every write and compaction
+        self.refresh()
+        with self._lock:
+            state = (self._snapshot_stamp, self._journal_inode, self._journal_offset)
+        return hashlib.blake2b(repr(state).encode(), digest_size=8).hexdigest()
+
+    # reads
+
+    def all(self):
+        self.refresh()
+        with self._lock:
+            return dict(self._data)
+
+    def get(self, patient_id):
+        self.refresh()
+        return self._data.get(patient_id)
+
+    def __contains__(self, patient_id):
+        self.refresh()
+        return patient_id in self._data
+
+    def __len__(self):
+        self.refresh()
+        return len(self._data)
+
+    def sorted_by(self, field, descending=False, limit=None, after=None):
+        index = self._indexes.get(field)
+        if index is None:
+            return super().sorted_by(field, descending, limit, after)
+        self.refresh()
+        with self._lock:
+            start = 0 if after is None else index.position_after(after, descending)
+            ids = index.ids(descending, start, limit)
+            return [(patient_id, self._data[patient_id]) for patient_id in ids]
+
+    def page(self, after=None, limit=None):
+        cursor = None if after is None else (after, after)
+        return self.sorted_by("id", after=cursor, limit=limit)
+
+    def search(self, filters, limit=None, after=None):
+        self.refresh()
+        with self._lock:
+            equal = {field: value for field, value in filters.items() if field in EQUALITY_FILTERS}
+            ranges = {field: value for field, value in filters.items() if field in RANGE_FILTERS}
+            if not equal and not ranges:
+                return search_result(len(self._data), self.page(after, limit), self._facets.facets(FACET_FIELDS, {}))
+            if equal:
+                # intersect the inverted index sets, smallest first
+                sets = sorted((self._inverted[field].ids(value) for field, value in equal.items()), key=len)
+                ids = set(sets[0]).intersection(*sets[1:])
+            else:
+                # each range is one slice of a sorted index; start from the narrowest
+                slices = [self._indexes[field].ids_between(*bounds) for field, bounds in ranges.items() if field in self._indexes]
+                ids = min(slices, key=len) if slices else self._data
+            if ranges:
+                ids = [patient_id for patient_id in ids if matches(self._data[patient_id], ranges)]
+                # range filters cut across the facet table, so count the (already narrowed) matches
+                facets = {field: dict(Counter(self._data[patient_id].get(field) for patient_id in ids)) for field in FACET_FIELDS}
+            else:
+                facets = self._facets.facets(FACET_FIELDS, equal)
+            page = (patient_id for patient_id in ids if after is None or patient_id > after)
+            page = heapq.nsmallest(limit, page) if limit is not None else sorted(page)
+            return search_result(len(ids), [(patient_id, self._data[patient_id]) for patient_id in page], facets)
+
+    def stats(self, percentiles=DEFAULT_PERCENTILES, age_bin=AGE_BIN_WIDTH):
+        if self._columns is None:
+            return super().stats(percentiles, age_bin)
+        self.refresh()
+        with self._lock:
+            sample = islice(self._data.values(), MEMORY_SAMPLE)
+            return dict(self._columns.stats(percentiles, age_bin), memory=self._columns.memory(sample))
+
+    # writes
+
+    def _flock(self, name, flags):
+        if fcntl is None:
+            return None
+        f = open(self.path + name, "a")
+        try:
+            fcntl.flock(f, flags)
+        except BlockingIOError:
+            f.close()
+            return None
+        return f
+
+    @contextmanager
+    def transaction(self):
+        """Exclusive write access across threads and worker processes.
+
+        The store is brought up to date on entry, so a check followed by a write
+        (exists? -> create, read -> modify -> put) can't interleave with another writer.
+        """
+        with self._lock:
+            if self._lock_depth == 0:
+                self._lock_file = self._flock(".lock", fcntl.LOCK_EX if fcntl else 0)
+            self._lock_depth += 1
+            try:
+                self.refresh()
+                yield self
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and self._lock_file is not None:
+                    self._lock_file.close()  # closing the file releases the flock
+                    self._lock_file = None
+
+    def put(self, patient_id, record):
+        """Store ``record`` and return its new version number."""
+        with self.transaction():
+            version = self._last_version + 1
+            record = dict(record, version=version)
+            self.journal.append("put", patient_id, record)
+            self._last_version = version
+            old = self._data.get(patient_id)
+            self._data[patient_id] = record
+            self._index_change(patient_id, old, record)
+            self._after_write()
+            return version
+
+    def put_many(self, items):
+        """Store every ``(patient_id, record)`` pair with one journal write; returns their new versions."""
+        with self.transaction():
+            entries = [("put", patient_id, dict(record, version=self._last_version + n))
+                       for n, (patient_id, record) in enumerate(items, 1)]
+            self.journal.append_many(entries)  # journal first, as in put(), so memory never runs ahead of disk
+            self._last_version += len(entries)
+            changes = []
+            for _, patient_id, record in entries:
+                changes.append((patient_id, self._data.get(patient_id), record))
+                self._data[patient_id] = record
+            for index in self._maintained:
+                index.update_many(changes)
+            self._after_write()
+            return [record["version"] for _, _, record in entries]
+
+    def delete(self, patient_id):
+        with self.transaction():
+            self.journal.append("del", patient_id)
+            old = self._data.pop(patient_id)
+            self._index_change(patient_id, old, None)
+            self._after_write()
+
+    def _index_change(self, patient_id, old, new):
+        for index in self._maintained:
+            index.update(patient_id, old, new)
+
+    def _after_write(self):
+        inode, size = self.journal.stamp()
+        self._journal_inode = inode
+        self._journal_offset = size
+        if size > self.compact_threshold and not self._compacting:
+            self._compacting = True
+            self._compaction = threading.Thread(target=self.compact, daemon=True)
+            self._compaction.start()
+
+    # snapshot / compaction
+
+    def _write_snapshot_tmp(self, data, path):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            fast_json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        return tmp
+
+    def _write_snapshot(self, data, path):
+        os.replace(self._write_snapshot_tmp(data, path), path)  # atomic, so a crash never leaves a truncated snapshot
+
+    def _fold_old_journal(self, data):
+        tmp = self._write_snapshot_tmp(data, self.path)
+        with self._lock:
+            # swapped in and stamped in one step, so a write in this process never
+            # sees its own compaction as an outside change and reloads everything
+            os.replace(tmp, self.path)
+            self._snapshot_stamp = self._file_stamp()
+            if os.path.exists(self._old_journal_path):
+                os.remove(self._old_journal_path)
+
+    def compact(self):
+        """Fold the journal into a new snapshot of ``patients.json``."""
+        # only one worker compacts at a time; the others simply skip
+        compact_lock = self._flock(".compact.lock", fcntl.LOCK_EX | fcntl.LOCK_NB) if fcntl else None
+        if fcntl is not None and compact_lock is None:
+            self._compacting = False
+            return
+        try:
+            if os.path.exists(self._old_journal_path):
+                # left behind by a compaction that died half way; finish it before rotating again
+                with self.transaction():
+                    data = dict(self._data)
+                self._fold_old_journal(data)
+            with self.transaction():
+                data = dict(self._data)
+                self.journal.rotate(self._old_journal_path, self._last_version)
+                self._journal_inode, self._journal_offset = self.journal.stamp()
+            # the slow part runs without the write lock; new writes go to the fresh journal
+            self._fold_old_journal(data)
+        finally:
+            self._compacting = False
+            if compact_lock is not None:
+                compact_lock.close()
+
+    # import / export in the plain patients.json format
+
+    def export_json(self, path):
+        self._write_snapshot(self.all(), path)
+
+    def import_json(self, path):
+        with open(path, "rb") as f:
+            data = fast_json.load(f)
+        with self.transaction():
+            # imported records get fresh versions, so none repeats one this store has handed out
+            data = {patient_id: dict(normalize_record(record), version=self._last_version + n)
+                    for n, (patient_id, record) in enumerate(data.items(), 1)}
+            # the imported file replaces everything, so the journal is discarded
+            self.journal.rotate(self._old_journal_path, self._last_version + len(data))
+            if os.path.exists(self._old_journal_path):
+                os.remove(self._old_journal_path)
+            self._write_snapshot(data, self.path)
+            self._reload()
+
+    def close(self):
+        if self._compaction is not None:
+            self._compaction.join()
+        self.journal.close()
@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """LRU + TTL cache of model outputs, keyed on the engineered feature row.
+
+    ``key(row)`` is the tuple of ``columns`` taken from a feature dict. ``quantize``
+    maps a column to a step size (e.g. ``{"bmi": 0.1}``) so nearby values share an
+    entry. When the cache is full the least recently used entry goes, and entries
+    older than ``ttl`` seconds are treated as misses.
+
+    ``model_stamp`` is a callable returning something that changes when the model
+    changes (the model file's stamp, or a registry version). It is polled at most
+    every ``check_interval`` seconds and the cache is cleared when it changes.
+    ``put(key, value, stamp)`` tags an entry with the stamp of the model that
+    computed it: a value from any other model is never served, so a request still
+    scoring on the old model can't refill the cache after a swap.
+    """
+
+    def __init__(self, columns, maxsize=10000, ttl=3600.0, quantize=None, model_stamp=None, check_interval=1.0):
+        self.columns = tuple(columns)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.quantize = {column: step for column, step in (quantize or {}).items() if step}
+        self.model_stamp = model_stamp
+        self.check_interval = check_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stamp = model_stamp() if model_stamp else None
+        self._checked = time.monotonic()
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def key(self, row):
+        key = []
+        for column in self.columns:
+            value = row[column]
+            step = self.quantize.get(column)
+            if step:
+                value = round(round(value / step) * step, 10)
+            key.append(value)
+        return tuple(key)
+
+    def _check_model(self, now, force=False):
+        if self.model_stamp is None or not force and now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        stamp = self.model_stamp()
+        if stamp != self._stamp:
+            self._stamp = stamp
+            self._entries.clear()
+            self.invalidations += 1
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._check_model(now)
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            elif entry is not None and entry[2] != self._stamp:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, stamp=None):
+        if self.maxsize <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if stamp is None or self.model_stamp is None:
+                stamp = self._stamp  # untagged: taken to come from the current model
+            elif stamp != self._stamp:
+                self._check_model(now, force=True)  # a newer model may be in, not yet noticed
+                if stamp != self._stamp:
+                    return  # computed by a model that is no longer current
+            self._entries[key] = (now, value, stamp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "quantize": self.quantize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,115 @@
+import io
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+INPUT_COLUMNS = ["age", "weight", "height", "income_lpa", "smoker", "city", "occupation"]
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_CONCURRENCY = 4
+TIMEOUT = (5, 120)  # connect, read (seconds)
+
+
+class PredictionError(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(f"API error {status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+def make_session(pool_size=DEFAULT_CONCURRENCY, retries=3, backoff=0.5):
+    """Session with a keep-alive pool of ``pool_size`` connections that retries with exponential backoff.
+
+    Scoring has no side effects, so POSTs are retried too: on connection errors and on
+    429/502/503/504, honouring ``Retry-After`` (the API sends one with its 503 when saturated).
+    """
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 502, 503, 504),
+                  allowed_methods=frozenset({"GET", "POST"}), respect_retry_after_header=True,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _result(response):
+    try:
+        body = response.json()
+    except ValueError:
+        body = response.text
+    if response.status_code != 200:
+        raise PredictionError(response.status_code, body.get("detail", body) if isinstance(body, dict) else body)
+    return body["response"]
+
+
+def predict(session, api_url, user):
+    """Prediction for one user dict via ``POST /predict``."""
+    return _result(session.post(f"{api_url}/predict", json=user, timeout=TIMEOUT))
+
+
+def score_chunk(session, api_url, body):
+    """``[(prediction, error)]`` per row of ``body``, a CSV of users with a header line.
+
+    Rows the API rejects get an error and the rest are scored. The result depends only
+    on ``api_url`` and ``body``, so a caller can cache it on those.
+    """
+    response = session.post(f"{api_url}/predict/batch", data=body, headers={"Content-Type": "text/csv"},
+                            timeout=TIMEOUT)
+    if response.status_code != 422:
+        return [(prediction, None) for prediction in _result(response)]
+    # one invalid row fails the whole request: note why per row and send the others again
+    errors = {}
+    for error in response.json()["detail"]:
+        index, *field = error["loc"]
+        errors.setdefault(index, []).append(f"{'.'.join(map(str, field)) or 'row'}: {error['msg']}")
+    chunk = pd.read_csv(io.BytesIO(body))
+    valid = [i for i in range(len(chunk)) if i not in errors]
+    scored = iter(score_chunk(session, api_url, chunk.iloc[valid].to_csv(index=False).encode()) if valid else [])
+    return [(None, "; ".join(errors[i])) if i in errors else next(scored) for i in range(len(chunk))]
+
+
+def score_frame(session, api_url, frame, chunk_size=DEFAULT_CHUNK_SIZE, concurrency=DEFAULT_CONCURRENCY,
+                on_progress=None, score=score_chunk):
+    """Score every row of ``frame`` and return it with the prediction columns added.
+
+    Adds ``predicted_category``, ``confidence``, one ``prob_<class>`` column per class and
+    ``error`` (the reason a row was rejected, empty otherwise). Each chunk of ``chunk_size``
+    rows goes to ``score(session, api_url, csv_bytes)``, up to ``concurrency`` at a time;
+    pass a cached :func:`score_chunk` to reuse results for chunks scored before.
+    ``on_progress(done, total)`` is called from this thread as chunks finish.
+    """
+    missing = [column for column in INPUT_COLUMNS if column not in frame.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    inputs = frame[INPUT_COLUMNS].reset_index(drop=True)
+    chunks = {start: inputs.iloc[start:start + chunk_size].to_csv(index=False).encode()
+              for start in range(0, len(inputs), chunk_size)}
+    results = [None] * len(inputs)
+    done = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(score, session, api_url, body): start for start, body in chunks.items()}
+        try:
+            for future in as_completed(futures):
+                start = futures[future]
+                rows = future.result()
+                results[start:start + len(rows)] = rows
+                done += len(rows)
+                if on_progress is not None:
+                    on_progress(done, len(inputs))
+        except BaseException:
+            for future in futures:
+                future.cancel()  # don't keep sending chunks once one has failed
+            raise
+
+    predictions = [prediction or {} for prediction, _ in results]
+    scored = frame.reset_index(drop=True).copy()
+    scored["predicted_category"] = [p.get("predicted_category") for p in predictions]
+    scored["confidence"] = [p.get("confidence") for p in predictions]
+    classes = sorted({c for p in predictions for c in p.get("class_probabilities", {})})
+    for c in classes:
+        scored[f"prob_{c}"] = [p.get("class_probabilities", {}).get(c) for p in predictions]
+    scored["error"] = [error or "" for _, error in results]
+    return scored
@@ -0,0 +1,68 @@
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """LRU cache of rendered response bodies, each kept with the state it was rendered from.
+
+    ``get(key, revision)`` only returns a body stored with an equal ``revision`` (the
+    store's revision for whole-store responses, the record itself for a single
+    patient), so a write made by any worker process is never answered from here.
+    Writes in this process also :meth:`discard` what they touched straight away.
+    Bounded by ``maxsize`` entries and ``max_bytes`` of bodies, least recently used first;
+    a body larger than ``max_bytes`` is not cached.
+    """
+
+    def __init__(self, maxsize=256, max_bytes=64 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, key, revision):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != revision:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, revision, body):
+        if self.maxsize <= 0 or len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._entries[key] = (revision, body)
+            self._bytes += len(body)
+            while len(self._entries) > self.maxsize or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def discard(self, predicate):
+        """Drop every entry whose key satisfies ``predicate(key)``."""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self._bytes -= len(self._entries.pop(key)[1])
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
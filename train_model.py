@@ -0,0 +1,103 @@
+"""Retrain the insurance premium model from a CSV, reproducibly.
+
+Same pipeline, split and seeds as exp_notebook/fastapi_ml_model.ipynb, but the
+features come from insurance_features.engineer_features, the exact code the
+API scores with, and the forest is fit with n_jobs parallelism.
+
+    python train_model.py                                   # exp_notebook/insurance.csv -> exp_notebook/model.pkl
+    python train_model.py --scale 1000 --output /tmp/m.pkl  # a 1000x larger resampled dataset
+"""
+import argparse
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder
+
+from insurance_features import (CATEGORICAL_FEATURES, FEATURE_COLUMNS, INPUT_COLUMNS, NUMERIC_FEATURES,
+                                TARGET_COLUMN, engineer_features)
+
+CSV_DTYPES = {"age": "int64", "weight": "float64", "height": "float64", "income_lpa": "float64",
+              "smoker": "bool", "city": "object", "occupation": "object", TARGET_COLUMN: "object"}
+
+
+def load(path, scale=1, seed=0):
+    """Read the training CSV; with ``scale`` > 1, resample it to ``scale`` times as many rows.
+
+    Resampled rows get a little noise on weight, height and income so the
+    larger dataset isn't just copies of the same points.
+    """
+    df = pd.read_csv(path, usecols=INPUT_COLUMNS + [TARGET_COLUMN], dtype=CSV_DTYPES)
+    if scale > 1:
+        rng = np.random.default_rng(seed)
+        df = df.iloc[rng.integers(0, len(df), len(df) * scale)].reset_index(drop=True)
+        for column, spread in (("weight", 0.02), ("height", 0.005), ("income_lpa", 0.05)):
+            df[column] *= 1 + rng.normal(0, spread, len(df))
+    return df
+
+
+def build_pipeline(n_estimators=100, n_jobs=-1, random_state=42):
+    preprocessor = ColumnTransformer(transformers=[
+        ("cat", OneHotEncoder(), CATEGORICAL_FEATURES),
+        ("num", "passthrough", NUMERIC_FEATURES),
+    ])
+    return Pipeline(steps=[
+        ("preprocessor", preprocessor),
+        ("classifier", RandomForestClassifier(n_estimators=n_estimators, n_jobs=n_jobs, random_state=random_state)),
+    ])
+
+
+def save(pipeline, path):
+    """Pickle to a temp file and rename it into place, so a running API never loads half a model."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(pipeline, f)
+    os.replace(tmp, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default="exp_notebook/insurance.csv")
+    parser.add_argument("--output", default="exp_notebook/model.pkl")
+    parser.add_argument("--scale", type=int, default=1, help="resample the data to this many times its size")
+    parser.add_argument("--n-estimators", type=int, default=100)
+    parser.add_argument("--n-jobs", type=int, default=-1, help="cores for fitting the forest (-1 = all)")
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--split-seed", type=int, default=1)
+    parser.add_argument("--model-seed", type=int, default=42)
+    args = parser.parse_args()
+
+    timings = {}
+    start = time.perf_counter()
+    df = load(args.data, args.scale, args.split_seed)
+    timings["load"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    X = engineer_features(df)[FEATURE_COLUMNS]
+    y = df[TARGET_COLUMN]
+    timings["features"] = time.perf_counter() - start
+
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=args.test_size, random_state=args.split_seed)
+    pipeline = build_pipeline(args.n_estimators, args.n_jobs, args.model_seed)
+    start = time.perf_counter()
+    pipeline.fit(X_train, y_train)
+    timings["fit"] = time.perf_counter() - start
+
+    accuracy = accuracy_score(y_test, pipeline.predict(X_test))
+    # serve single-threaded: the API batches requests itself, and a per-call thread pool only adds latency
+    pipeline.named_steps["classifier"].set_params(n_jobs=None)
+    save(pipeline, args.output)
+
+    print(f"{len(df)} rows ({len(X_train)} train / {len(X_test)} test), test accuracy {accuracy:.4f}")
+    print("  ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()), f"-> {args.output}")
+
+
+if __name__ == "__main__":
+    main()